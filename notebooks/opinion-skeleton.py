@@ -3,10 +3,10 @@
 import json
 import random
 import typing as t
-from datetime import datetime
 from enum import Enum
 
-from bsky_net import Post, did_from_uri, records
+from bsky_net import Post, bucket_label, did_from_uri, records, time_bucket
+from bsky_net import TimeFormat as BucketFormat
 
 # Constants
 STREAM_DIR = "../data/raw/chron-stream-2023-07-01"
@@ -55,6 +55,10 @@ class TimeFormat(str, Enum):
     monthly = "%Y-%m"
 
 
+# Bucketing granularity for each label format
+BUCKET_FORMATS = {f.value: BucketFormat[f.name] for f in TimeFormat}
+
+
 graph: dict[str, dict] = {}
 impressions: dict[str, dict[str, UserTimestep]] = {}
 post_ref: dict[str, dict] = {}  # Store of all relevant posts
@@ -73,7 +77,8 @@ def get_time_key(created_at: str, grouping: str) -> str:
 
     e.g. "2023-01-01" for "daily, "2023-01" for "monthly"
     """
-    return datetime.fromisoformat(created_at.replace("Z", "+00:00")).strftime(grouping)
+    bucket_format = BUCKET_FORMATS[grouping]
+    return bucket_label(time_bucket(created_at, bucket_format), bucket_format, grouping)
 
 
 def add_reaction(
@@ -276,31 +276,32 @@ post_counts = Counter()
 internal_belief_log = []
 current_belief: InternalBelief = "favor"
 
-for step, data in bsky_net.simulate():
-    if did in data:
-        seen = data[did]["seen"]
-        posted = data[did]["posted"]
-
-        observed_beliefs: list[ExpressedBelief] = [
-            post_belief
-            for record in seen.values()
-            for post_topic, post_belief in record["labels"]
-            if post_topic == "moderation"
-        ]
-        expressed_beliefs: list[ExpressedBelief] = [
-            post_belief
-            for record in posted.values()
-            for post_topic, post_belief in record["labels"]
-            if post_topic == "moderation"
-        ]
-
-        # true_belief = majority_rule(expressed_beliefs, "none")
-        # pred_belief = majority_rule(observed_beliefs, "none")
-        # print((step, pred_belief, true_belief))
-        print("expressed beliefs: ", json.dumps(Counter(expressed_beliefs), indent=2))
-        print("observed beliefs: ", json.dumps(Counter(observed_beliefs), indent=2))
-
-        # print([post["text"] for post in user_posts.values()])
-
-        # beliefs = [post["belief"] for post in user_posts.values()]
-        # internal_belief_log.append(beliefs)
+# Only the steps this user was active in; scans every step unless
+# scripts/index-users.py has built a `UserIndex`
+for step, activity in bsky_net.user_history(did):
+    seen = activity["seen"]
+    posted = activity["posted"]
+
+    observed_beliefs: list[ExpressedBelief] = [
+        post_belief
+        for record in seen.values()
+        for post_topic, post_belief in record["labels"]
+        if post_topic == "moderation"
+    ]
+    expressed_beliefs: list[ExpressedBelief] = [
+        post_belief
+        for record in posted.values()
+        for post_topic, post_belief in record["labels"]
+        if post_topic == "moderation"
+    ]
+
+    # true_belief = majority_rule(expressed_beliefs, "none")
+    # pred_belief = majority_rule(observed_beliefs, "none")
+    # print((step, pred_belief, true_belief))
+    print("expressed beliefs: ", json.dumps(Counter(expressed_beliefs), indent=2))
+    print("observed beliefs: ", json.dumps(Counter(observed_beliefs), indent=2))
+
+    # print([post["text"] for post in user_posts.values()])
+
+    # beliefs = [post["belief"] for post in user_posts.values()]
+    # internal_belief_log.append(beliefs)
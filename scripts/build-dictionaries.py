@@ -0,0 +1,35 @@
+"""Build the shared DID and post URI dictionaries (see `StringDict`)."""
+
+import typing as t
+
+from bsky_net import StringDict, records
+
+STREAM_DIR = "data/raw/en-stream-2023-07-01"
+OUTPUT_DIR = "data/processed/dictionaries"
+
+START_DATE = "2022-11-17"
+END_DATE = "2023-07-01"
+
+
+def all_dids() -> t.Iterable[str]:
+    # ~6M DIDs, each seen many times, so deduplicate in memory first
+    dids: dict[str, None] = {}
+    for record in records(STREAM_DIR, START_DATE, END_DATE):
+        dids[record["did"]] = None
+        if record["$type"] in ("app.bsky.graph.follow", "app.bsky.graph.block"):
+            dids[record["subject"]] = None
+    return dids
+
+
+def post_uris() -> t.Iterator[str]:
+    # Each post is created once, so URIs can be streamed straight to disk
+    for post in records(STREAM_DIR, START_DATE, END_DATE, types={"app.bsky.feed.post"}):
+        yield post["uri"]
+
+
+if __name__ == "__main__":
+    dids = StringDict.build(f"{OUTPUT_DIR}/dids", all_dids())
+    print(f"\n{len(dids)} DIDs saved to {OUTPUT_DIR}/dids")
+
+    uris = StringDict.build(f"{OUTPUT_DIR}/uris", post_uris())
+    print(f"\n{len(uris)} post URIs saved to {OUTPUT_DIR}/uris")
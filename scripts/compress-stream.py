@@ -0,0 +1,21 @@
+"""Compress the daily JSONL stream into seekable zstd files."""
+
+import os
+
+from bsky_net import generate_timestamps, tq, zst
+
+STREAM_DIR = "data/raw/en-stream-2023-07-01"
+REMOVE_ORIGINALS = False
+
+START_DATE = "2022-11-17"
+END_DATE = "2023-07-01"
+
+if __name__ == "__main__":
+    for day in tq(generate_timestamps(START_DATE, END_DATE)):
+        path = f"{STREAM_DIR}/{day}.jsonl"
+        zst.compress(path)
+
+        if REMOVE_ORIGINALS:
+            os.remove(path)
+
+    print(f"\nCompressed stream saved to {STREAM_DIR}/")
@@ -0,0 +1,13 @@
+"""Mirror the daily JSONL stream to parquet, partitioned by record type."""
+
+from bsky_net import parquet
+
+STREAM_DIR = "data/raw/en-stream-2023-07-01"
+OUTPUT_DIR = "data/raw/en-stream-2023-07-01-parquet"
+
+START_DATE = "2022-11-17"
+END_DATE = "2023-07-01"
+
+if __name__ == "__main__":
+    parquet.convert(STREAM_DIR, OUTPUT_DIR, START_DATE, END_DATE)
+    print(f"\nParquet mirror saved to {OUTPUT_DIR}/")
@@ -0,0 +1,13 @@
+"""Convert the time steps of a processed network to a binary format."""
+
+from bsky_net import bsn, csr
+
+NET_DIR = "data/processed/engagement-daily-2023-04-01"
+
+# "bsn": per-user msgpack, decoded lazily
+# "csr": one post table plus seen/posted/liked adjacency arrays, no duplicated posts
+FORMAT = "csr"
+
+if __name__ == "__main__":
+    {"bsn": bsn, "csr": csr}[FORMAT].convert(NET_DIR)
+    print(f"\nBinary time steps saved to {NET_DIR}/")
@@ -0,0 +1,10 @@
+"""Precompute per-topic belief counts for each time step of a processed network."""
+
+from bsky_net import BskyNet
+
+NET_DIR = "data/processed/bsky-net-daily"
+TOPICS = ["moderation"]
+
+if __name__ == "__main__":
+    BskyNet(NET_DIR).count_beliefs(TOPICS)
+    print(f"\nBelief counts saved to {NET_DIR}/.beliefs/")
@@ -1,7 +1,6 @@
 # Script to filter Bluesky's data stream to be English-only and non-spam.
 
 
-import json
 import os
 import shutil
 import typing as t
@@ -9,7 +8,7 @@ import typing as t
 import langid
 from pydantic import BaseModel
 
-from bsky_net import Post, Record, TimeFormat, records, truncate_timestamp
+from bsky_net import LazyRecord, Metrics, Post, TimeFormat, records, truncate_timestamp
 
 STREAM_DIR = "data/raw/stream-2023-07-01"
 OUTPUT_DIR = "data/raw/en-stream-2023-07-01"
@@ -67,9 +66,10 @@ def get_subject_uri(post: Post) -> t.Optional[str]:
         return None
 
 
-def write_record(record: Record, day: str, output_dir: str):
-    with open(f"{output_dir}/{day}.jsonl", "a") as jsonl_file:
-        jsonl_file.write(json.dumps(record) + "\n")
+def write_record(record: LazyRecord, day: str, output_dir: str):
+    # Copy the original line rather than re-encoding the record
+    with open(f"{output_dir}/{day}.jsonl", "ab") as jsonl_file:
+        jsonl_file.write(record.raw.rstrip(b"\n") + b"\n")
 
 
 # Clear the output directory
@@ -80,7 +80,7 @@ os.makedirs(OUTPUT_DIR)
 clean_posts: set[str] = set()  # clean = English, non-spam
 
 # Iterate through records
-for record in records(STREAM_DIR):
+for record in records(STREAM_DIR, lazy=True, metrics=Metrics(interval=5)):
     did = record["did"]
     day = truncate_timestamp(record["createdAt"], TimeFormat.daily)
 
@@ -0,0 +1,14 @@
+"""Build the per-day line index used to skip records by type or DID."""
+
+from bsky_net import LineIndex, generate_timestamps, tq
+
+STREAM_DIR = "data/raw/en-stream-2023-07-01"
+
+START_DATE = "2022-11-17"
+END_DATE = "2023-07-01"
+
+if __name__ == "__main__":
+    for day in tq(generate_timestamps(START_DATE, END_DATE)):
+        LineIndex.build(f"{STREAM_DIR}/{day}.jsonl")
+
+    print(f"\nLine indexes saved to {STREAM_DIR}/")
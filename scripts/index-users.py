@@ -0,0 +1,9 @@
+"""Build the did -> time step index used by `BskyNet.user_history`."""
+
+from bsky_net import BskyNet, UserIndex
+
+NET_DIR = "data/processed/bsky-net-daily"
+
+if __name__ == "__main__":
+    UserIndex.build(BskyNet(NET_DIR))
+    print(f"\nUser index saved to {UserIndex.path_for(NET_DIR)}/")
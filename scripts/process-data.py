@@ -4,10 +4,20 @@ import json
 import os
 import random
 import typing as t
-from datetime import datetime
 from enum import Enum
 
-from bsky_net import Follow, Like, Post, Repost, did_from_uri, records
+from bsky_net import (
+    Follow,
+    Like,
+    Metrics,
+    Post,
+    Repost,
+    bucket_label,
+    did_from_uri,
+    records,
+    time_bucket,
+)
+from bsky_net import TimeFormat as BucketFormat
 
 
 class TimeFormat(Enum):
@@ -17,6 +27,10 @@ class TimeFormat(Enum):
     monthly = "%Y-%m"
 
 
+# Bucketing granularity for each label format
+BUCKET_FORMATS = {f.value: BucketFormat[f.name] for f in TimeFormat}
+
+
 # ===== Helper functions =====
 
 
@@ -25,7 +39,8 @@ def get_time_key(created_at: str, grouping: str) -> str:
     Get the relevant subset of a timestamp for a given grouping.
     e.g. "2023-01-01" for "daily, "2023-01" for "monthly"
     """
-    return datetime.fromisoformat(created_at.replace("Z", "+00:00")).strftime(grouping)
+    bucket_format = BUCKET_FORMATS[grouping]
+    return bucket_label(time_bucket(created_at, bucket_format), bucket_format, grouping)
 
 
 def extract_quoted_uri(post: Post) -> t.Optional[str]:
@@ -90,6 +105,7 @@ class UserTimestep(t.TypedDict):
 STREAM_PATH = "./data/raw/records-2023-07-01.jsonl"
 OUTPUT_DIR = "./data/processed"
 END_DATE = "2023-04-01"  # TODO: Extend this
+WORKERS = 0  # Processes decoding chunks of STREAM_PATH; measure before raising
 
 if __name__ == "__main__":
     # Graph of users and their followers
@@ -160,7 +176,13 @@ if __name__ == "__main__":
 
         return
 
-    for record in records(stream_path=STREAM_PATH, end_date=END_DATE):
+    for record in records(
+        stream_path=STREAM_PATH,
+        end_date=END_DATE,
+        workers=WORKERS,
+        metrics=Metrics(interval=5),
+        dedupe=True,
+    ):
         time_key = get_time_key(record["createdAt"], time_period.value)
         record_count += 1
 
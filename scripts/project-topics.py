@@ -0,0 +1,10 @@
+"""Write per-topic projections of a processed network, for `simulate(topic=...)`."""
+
+from bsky_net import BskyNet
+
+NET_DIR = "data/processed/bsky-net-daily"
+TOPICS = ["moderation"]
+
+if __name__ == "__main__":
+    BskyNet(NET_DIR).project(TOPICS)
+    print(f"\nTopic projections saved to {NET_DIR}/.topics/")
@@ -0,0 +1,34 @@
+"""Write a deterministic user-sampled subset of the daily JSONL stream."""
+
+import os
+
+from bsky_net import generate_timestamps, records, tq
+
+STREAM_DIR = "data/raw/en-stream-2023-07-01"
+SAMPLE_FRACTION = 0.01
+SEED = 0
+OUTPUT_DIR = f"data/raw/en-stream-2023-07-01-sample-{SAMPLE_FRACTION}-{SEED}"
+
+START_DATE = "2022-11-17"
+END_DATE = "2023-07-01"
+
+if __name__ == "__main__":
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+    for day in tq(generate_timestamps(START_DATE, END_DATE)):
+        sampled = records(
+            STREAM_DIR,
+            start_date=day,
+            end_date=day,
+            log=False,
+            lazy=True,
+            sample_users=SAMPLE_FRACTION,
+            seed=SEED,
+        )
+
+        # Copy the original lines rather than re-encoding the records
+        with open(f"{OUTPUT_DIR}/{day}.jsonl", "wb") as f:
+            for record in sampled:
+                f.write(record.raw.rstrip(b"\n") + b"\n")
+
+    print(f"\nSampled stream saved to {OUTPUT_DIR}/")
@@ -0,0 +1,23 @@
+"""Sort the daily JSONL stream into chronologically ordered daily files."""
+
+from bsky_net import chron
+
+STREAM_DIR = "data/raw/en-stream-2023-07-01"
+OUTPUT_DIR = "data/raw/chron-stream-2023-07-01"
+
+START_DATE = "2022-11-17"
+END_DATE = "2023-07-01"
+
+SORT_KEY = "createdAt"  # or "ts", "rkey"
+MEMORY_BYTES = 8 * 1024**3
+
+if __name__ == "__main__":
+    chron.convert(
+        STREAM_DIR,
+        OUTPUT_DIR,
+        START_DATE,
+        END_DATE,
+        key=SORT_KEY,
+        memory_bytes=MEMORY_BYTES,
+    )
+    print(f"\nChronological stream saved to {OUTPUT_DIR}/")
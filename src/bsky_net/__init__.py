@@ -1,13 +1,35 @@
+import asyncio
+import heapq
+import io
 import mmap
 import os
+import queue
+import re
+import shutil
+import struct
 import sys
+import threading
 import time
 import typing as t
-from datetime import datetime, timedelta
-from enum import Enum
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from enum import Enum, IntEnum
+from functools import cached_property, lru_cache
+from hashlib import blake2b
+from itertools import groupby, islice
 from pathlib import Path
 
+import msgpack
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.json as pa_json
+import pyarrow.parquet as pq
 import ujson as json
+import zstandard
 from openai.types.shared_params.response_format_json_schema import JSONSchema
 
 T = t.TypeVar("T")
@@ -42,100 +64,3154 @@ class BskyNet:
 
         self.files = self._get_files()
         self.time_steps = self._get_time_steps()
+        self._users: t.Optional[StringDict] = None
+        # Derived directories found current, so they're checked once
+        self._current: set[str] = set()
 
     def simulate(
-        self, stop_idx: t.Optional[int] = None, verbose: bool = False
-    ) -> t.Generator[tuple[int, dict[str, UserActivity]], None, None]:
-        for i, time_step in enumerate(tq(self.files, active=verbose)):
-            if stop_idx and i == stop_idx:
+        self,
+        stop_idx: t.Optional[int] = None,
+        verbose: bool = False,
+        prefetch: int = 0,
+        metrics: t.Optional["Metrics"] = None,
+        topic: t.Optional[str] = None,
+        start: t.Union[int, str, None] = None,
+        stop: t.Union[int, str, None] = None,
+        stride: int = 1,
+    ) -> t.Generator[tuple[int, t.Mapping[str, UserActivity]], None, None]:
+        """
+        Yield `(i, activity)` for each time step, or every `stride`th step from
+        `start` up to (not including) `stop`. Steps are indices or time step names;
+        a name that isn't a time step (e.g. a day, for hourly steps) means the first
+        step at or after it. `stop_idx` is the older spelling of `stop`.
+
+        With `topic`, only the users with records labelled with that topic are
+        yielded, holding only those records, read from the projection written by
+        `project` (so unlabelled activity is never loaded).
+
+        Time steps converted to `.bsn` (see `bsn.convert`) are yielded as a lazy
+        `Timestep` mapping, which only decodes the users and fields that are read.
+        `.csr` steps are `PostGraph`s, whose posts hold `createdAt` and `labels`.
+        With `prefetch > 0`, up to that many time steps are read and decoded ahead
+        in a background thread while the caller works on the current one. Time
+        steps and bytes read are counted in `metrics`, if given (instead of the
+        `verbose` output).
+        """
+        if topic is not None:
+            yield from self._projection(topic).simulate(
+                stop_idx,
+                verbose,
+                prefetch,
+                metrics,
+                start=start,
+                stop=stop,
+                stride=stride,
+            )
+            return
+
+        if stop is None:
+            stop = stop_idx or None
+        indices = range(
+            *slice(self._index(start), self._index(stop), stride).indices(len(self))
+        )
+        steps = self._load_steps(indices, verbose and metrics is None, prefetch > 0)
+        if metrics is not None:
+            if metrics.total is None:
+                metrics.total = len(indices)
+            steps = self._measure(steps, metrics)
+        yield from prefetched(steps, prefetch) if prefetch else steps
+
+    async def asimulate(
+        self,
+        stop_idx: t.Optional[int] = None,
+        verbose: bool = False,
+        depth: int = 2,
+        metrics: t.Optional["Metrics"] = None,
+        topic: t.Optional[str] = None,
+    ) -> t.AsyncGenerator[tuple[int, t.Mapping[str, UserActivity]], None]:
+        """`simulate` for `async for`: time steps are loaded in a background thread."""
+        steps = self.simulate(stop_idx, verbose, metrics=metrics, topic=topic)
+        async for step in aiterate(steps, depth):
+            yield step
+
+    def _measure(
+        self,
+        steps: t.Iterator[tuple[int, t.Mapping[str, UserActivity]]],
+        metrics: "Metrics",
+    ) -> t.Generator[tuple[int, t.Mapping[str, UserActivity]], None, None]:
+        try:
+            for i, activity in steps:
+                path = f"{self.path}/{self.files[i]}"
+                metrics.add(1, sum(map(os.path.getsize, self._step_paths(path))))
+                yield i, activity
+        finally:
+            metrics.close()
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    def __getitem__(self, step: t.Union[int, str]) -> t.Mapping[str, UserActivity]:
+        """The activity of one time step, by index or name."""
+        if isinstance(step, str) and step not in self.time_steps:
+            raise KeyError(step)
+        i = self._index(step)
+        if not -len(self) <= i < len(self):
+            raise IndexError(step)
+        return self._load_step(i % len(self))
+
+    def _index(self, step: t.Union[int, str, None]) -> t.Optional[int]:
+        if isinstance(step, str):
+            return bisect_left(self.time_steps, step)
+        return step
+
+    def _load_steps(
+        self, indices: range, verbose: bool, hint: bool
+    ) -> t.Generator[tuple[int, t.Mapping[str, UserActivity]], None, None]:
+        for n, i in enumerate(tq(indices, active=verbose)):
+            if hint and n + 1 < len(indices):
+                for path in self._step_paths(
+                    f"{self.path}/{self.files[indices[n + 1]]}"
+                ):
+                    will_need(path)
+            yield i, self._load_step(i)
+
+    def _load_step(self, i: int) -> t.Mapping[str, UserActivity]:
+        path = f"{self.path}/{self.files[i]}"
+        if path.endswith(".csr"):
+            return csr.load(path)
+        if path.endswith(".bsn"):
+            return bsn.load(path)
+        with open(path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return json.loads(mm.read())
+
+    def user_history(self, did: str) -> list[tuple[int, UserActivity]]:
+        """
+        `(i, activity)` for each time step `did` was active in, read with the
+        `UserIndex` (see `UserIndex.build`) instead of decoding every step. Without
+        an up-to-date index, every step is read.
+        """
+        index = UserIndex.load(self)
+        if index is not None:
+            return index.history(did)
+        return [(i, step[did]) for i, step in self.simulate() if did in step]
+
+    def project(self, topics: t.Collection[str], log: bool = True) -> None:
+        """
+        Write each topic's projection of the network to `{path}/.topics/{topic}/`:
+        for every time step, a `.bsn` of the users with records labelled with the
+        topic, holding only those records. The time steps it was built from are
+        recorded, so a projection older than them is rejected (see `_sources`).
+        """
+        # Taken first, so a step rewritten while it's read leaves them stale
+        sources = self._sources()
+        for topic in topics:
+            shutil.rmtree(f"{self.path}/.topics/{topic}", ignore_errors=True)
+            os.makedirs(f"{self.path}/.topics/{topic}")
+
+        for i, activity in self.simulate(verbose=log):
+            projected: dict[str, dict[str, dict[str, dict]]] = {
+                topic: {} for topic in topics
+            }
+            for did, user in activity.items():
+                for kind in csr.KINDS:
+                    for uri, record in user.get(kind, {}).items():
+                        for topic in {label[0] for label in record["labels"]}:
+                            if topic not in projected:
+                                continue
+                            kinds = projected[topic].setdefault(
+                                did, {kind: {} for kind in csr.KINDS}
+                            )
+                            kinds[kind][uri] = record
+
+            step = self.time_steps[i]
+            for topic, users in projected.items():
+                bsn.write(f"{self.path}/.topics/{topic}/{step}.bsn", users)
+
+        for topic in topics:
+            self._write_sources(f"{self.path}/.topics/{topic}", sources)
+
+    def _projection(self, topic: str) -> "BskyNet":
+        path = f"{self.path}/.topics/{topic}"
+        if not os.path.isdir(path):
+            raise ValueError(f"No projection for {topic!r}; run project")
+        if not self._is_current(path):
+            raise ValueError(f"Projection for {topic!r} is stale; run project")
+        return BskyNet(path)
+
+    # Formats a time step can be stored in, most preferred first
+    FORMATS = (".csr", ".bsn", ".json")
+
+    def _get_files(self):
+        """
+        Each time step's `.json` file, or its `.csr`/`.bsn` conversion if any that
+        is at least as new (an older one predates the `.json` it came from).
+        Hidden files (e.g. `.sources.json`) aren't time steps.
+        """
+        steps: dict[str, dict[str, str]] = {}
+        for f in sorted(os.listdir(self.path)):
+            stem, suffix = os.path.splitext(f)
+            if suffix in self.FORMATS and not f.startswith("."):
+                steps.setdefault(stem, {})[suffix] = f
+
+        files = []
+        for stem in sorted(steps):
+            formats = steps[stem]
+            source = formats.get(".json")
+            source_mtime = (
+                os.stat(f"{self.path}/{source}").st_mtime_ns if source else None
+            )
+            for suffix in self.FORMATS:
+                f = formats.get(suffix)
+                if f is None:
+                    continue
+                if (
+                    f == source
+                    or source_mtime is None
+                    or os.stat(f"{self.path}/{f}").st_mtime_ns >= source_mtime
+                ):
+                    files.append(f)
+                    break
+        return files
+
+    @staticmethod
+    def _step_paths(path: str) -> list[str]:
+        """The files a time step is stored in (`.csr` steps are directories)."""
+        if os.path.isdir(path):
+            return [f"{path}/{f}" for f in sorted(os.listdir(path))]
+        return [path]
+
+    def _sources(self) -> list[list[t.Any]]:
+        """`[name, size, mtime_ns]` per time step, to detect stale derived files."""
+        return [[name, *_file_stat(f"{self.path}/{name}")] for name in self.files]
+
+    @staticmethod
+    def _write_sources(path: str, sources: list[list[t.Any]]) -> None:
+        with open(f"{path}/.sources.json", "w") as f:
+            json.dump(sources, f)
+
+    def _is_current(self, path: str) -> bool:
+        """Whether the files in `path` were derived from the current time steps."""
+        try:
+            with open(f"{path}/.sources.json") as f:
+                return json.load(f) == self._sources()
+        except FileNotFoundError:
+            return False
+
+    def _get_time_steps(self) -> list[str]:
+        return [Path(f).stem for f in self.files]
+
+    BELIEFS: tuple[ExpressedBelief, ...] = ("favor", "against", "none")
+
+    def count_beliefs(self, topics: t.Collection[str], log: bool = True) -> None:
+        """
+        Precompute `belief_counts` for `topics`, written to `{path}/.beliefs/`.
+
+        Users get global integer ids (a `StringDict` in `.beliefs/users`, in order
+        of first activity); `{step}.users.npy` holds the ids of a step's active
+        users and `{topic}/{step}.npy` their counts. As with `project`, counts
+        older than the time steps are rejected.
+        """
+        out_path = f"{self.path}/.beliefs"
+        # Taken first, so a step rewritten while it's read leaves them stale
+        sources = self._sources()
+        os.makedirs(out_path, exist_ok=True)
+        if os.path.exists(f"{out_path}/.sources.json"):
+            os.remove(f"{out_path}/.sources.json")
+        for topic in topics:
+            shutil.rmtree(f"{out_path}/{topic}", ignore_errors=True)
+            os.makedirs(f"{out_path}/{topic}")
+        self._current.clear()
+
+        user_ids: dict[str, int] = {}
+        kinds = {kind: k for k, kind in enumerate(csr.KINDS)}
+        beliefs = {belief: b for b, belief in enumerate(self.BELIEFS)}
+
+        for i, activity in self.simulate(verbose=log):
+            counts = {
+                topic: np.zeros((len(activity), len(kinds), len(beliefs)), np.int32)
+                for topic in topics
+            }
+            users = np.empty(len(activity), np.int32)
+
+            for row, (did, user) in enumerate(activity.items()):
+                users[row] = user_ids.setdefault(did, len(user_ids))
+                for kind, k in kinds.items():
+                    for record in user.get(kind, {}).values():
+                        for topic, belief in record["labels"]:
+                            if topic in counts and belief in beliefs:
+                                counts[topic][row, k, beliefs[belief]] += 1
+
+            step = self.time_steps[i]
+            np.save(f"{out_path}/{step}.users.npy", users)
+            for topic, array in counts.items():
+                np.save(f"{out_path}/{topic}/{step}.npy", array)
+
+        StringDict.build(f"{out_path}/users", user_ids)
+        self._users = None
+        for topic in topics:
+            self._write_sources(f"{out_path}/{topic}", sources)
+        self._write_sources(out_path, sources)
+
+    def belief_counts(self, topic: str, step: int) -> np.ndarray:
+        """
+        Label counts for `topic` at time step `step`, as a read-only memory-mapped
+        int32 array of shape `(n_active_users, 3, 3)`: `[user, kind, belief]` with
+        kinds `csr.KINDS` (seen, posted, liked) and beliefs `BskyNet.BELIEFS`
+        (favor, against, none). Row `j` is the user `belief_users(step)[j]`, in
+        the same order as the step's activity. Requires `count_beliefs`.
+        """
+        path = f"{self.path}/.beliefs/{topic}/{self.time_steps[step]}.npy"
+        if not os.path.exists(path):
+            raise ValueError(f"No belief counts for {topic!r}; run count_beliefs")
+        self._check_beliefs(f"{self.path}/.beliefs/{topic}", topic)
+        return np.load(path, mmap_mode="r")
+
+    def belief_users(self, step: int) -> np.ndarray:
+        """Global ids (see `users`) of the rows of `belief_counts(..., step)`."""
+        self._check_beliefs(f"{self.path}/.beliefs")
+        path = f"{self.path}/.beliefs/{self.time_steps[step]}.users.npy"
+        return np.load(path, mmap_mode="r")
+
+    @property
+    def users(self) -> "StringDict":
+        """`did <-> id` dictionary of the users in `belief_users`."""
+        if self._users is None:
+            self._check_beliefs(f"{self.path}/.beliefs")
+            self._users = StringDict(f"{self.path}/.beliefs/users")
+        return self._users
+
+    def _check_beliefs(self, path: str, topic: t.Optional[str] = None) -> None:
+        if path in self._current:
+            return
+        if not self._is_current(path):
+            what = "Belief counts" if topic is None else f"Belief counts for {topic!r}"
+            raise ValueError(f"{what} are stale; run count_beliefs")
+        self._current.add(path)
+
+    def get_beliefs(
+        self, topic: str, records: dict[str, LabeledRecord]
+    ) -> list[ExpressedBelief]:
+        return [
+            rec_opinion
+            for rec in records.values()
+            for rec_topic, rec_opinion in rec["labels"]
+            if rec_topic == topic
+        ]
+
+
+# === Binary time steps ===
+
+
+def _convert_steps(
+    net_path: str,
+    out_path: str,
+    suffix: str,
+    write: t.Callable[[str, t.Mapping[str, t.Mapping[str, t.Any]]], None],
+    log: bool,
+) -> None:
+    """Decode each `{step}.json` in `net_path` and `write` it to `{step}{suffix}`."""
+    os.makedirs(out_path, exist_ok=True)
+
+    files = [f for f in sorted(os.listdir(net_path)) if f.endswith(".json")]
+    for name in tq(files, active=log):
+        with open(f"{net_path}/{name}", "rb") as f:
+            activity = json.loads(f.read())
+        write(f"{out_path}/{Path(name).stem}{suffix}", activity)
+
+
+class bsn:
+    """
+    Binary time step format: `{step}.bsn` holds the same `{did: activity}` as
+    `{step}.json`, with each user's fields msgpack-encoded separately.
+
+    Layout: `MAGIC`, the header length (u32), a msgpack header with the user
+    `dids`, the field names and an `offsets` table (uint64, `n_users * n_fields + 1`
+    entries, relative to the body), then the body. A field a user doesn't have is
+    an empty span.
+    """
+
+    MAGIC = b"BSN1"
+
+    @classmethod
+    def write(cls, path: str, activity: t.Mapping[str, t.Mapping[str, t.Any]]) -> None:
+        fields = list(dict.fromkeys(k for user in activity.values() for k in user))
+        offsets = np.zeros(len(activity) * len(fields) + 1, dtype="<u8")
+        blobs = []
+
+        i = 0
+        for user in activity.values():
+            for field in fields:
+                blob = msgpack.packb(user[field]) if field in user else b""
+                blobs.append(blob)
+                offsets[i + 1] = offsets[i] + len(blob)
+                i += 1
+
+        header = msgpack.packb(
+            {"dids": list(activity), "fields": fields, "offsets": offsets.tobytes()}
+        )
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(cls.MAGIC)
+            f.write(struct.pack("<I", len(header)))
+            f.write(header)
+            for blob in blobs:
+                f.write(blob)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def convert(
+        cls, net_path: str, out_path: t.Optional[str] = None, log: bool = True
+    ) -> None:
+        """Write a `.bsn` for each `{step}.json` in `net_path` (or `out_path`)."""
+        _convert_steps(net_path, out_path or net_path, ".bsn", cls.write, log)
+
+    @classmethod
+    def load(cls, path: str) -> "Timestep":
+        return Timestep(path)
+
+
+class Timestep(t.Mapping[str, UserActivity]):
+    """
+    Lazy `{did: activity}` mapping over a memory-mapped `.bsn` file.
+
+    Only the header is decoded up front; each user's activity is a `UserView`
+    that decodes a field (`seen`, `posted`, `liked`) the first time it's read.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._mm[:4] != bsn.MAGIC:
+            raise ValueError(f"Not a .bsn file: {path}")
+        (header_len,) = struct.unpack("<I", self._mm[4:8])
+        header = msgpack.unpackb(self._mm[8 : 8 + header_len])
+
+        self.dids: list[str] = header["dids"]
+        self.fields: list[str] = header["fields"]
+        self._offsets = np.frombuffer(header["offsets"], dtype="<u8")
+        self._body = 8 + header_len
+        self._ids: t.Optional[dict[str, int]] = None
+
+    def __getitem__(self, did: str) -> UserActivity:
+        if self._ids is None:
+            self._ids = {d: i for i, d in enumerate(self.dids)}
+        return UserView(self, self._ids[did])  # type: ignore
+
+    def __iter__(self) -> t.Iterator[str]:
+        return iter(self.dids)
+
+    def __len__(self) -> int:
+        return len(self.dids)
+
+    def _span(self, user: int, field: int) -> tuple[int, int]:
+        i = user * len(self.fields) + field
+        return int(self._offsets[i]), int(self._offsets[i + 1])
+
+    def _decode(self, start: int, end: int) -> t.Any:
+        return msgpack.unpackb(self._mm[self._body + start : self._body + end])
+
+    def _user_spans(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Each user's byte range in the file (their fields are stored back to back)
+        and a bitmask of the `fields` they have.
+        """
+        n, n_fields = len(self.dids), len(self.fields)
+        if n_fields == 0:
+            return np.zeros(n, np.int64), np.zeros(n, np.int64), np.zeros(n, np.uint64)
+        if n_fields > 64:
+            raise ValueError(f"Too many fields in {self.path}: {n_fields}")
+
+        bounds = self._offsets.astype(np.int64)
+        starts, ends = bounds[: n * n_fields : n_fields], bounds[n_fields::n_fields]
+        present = np.diff(bounds).reshape(n, n_fields) > 0
+        bits = np.left_shift(np.uint64(1), np.arange(n_fields, dtype=np.uint64))
+        masks = (present * bits).sum(axis=1, dtype=np.uint64)
+        return self._body + starts, ends - starts, masks
+
+    def close(self) -> None:
+        self._mm.close()
+
+
+class UserView(t.Mapping[str, t.Any]):
+    """One user's activity in a `Timestep`; fields are decoded on first access."""
+
+    __slots__ = ("_step", "_user", "_cache")
+
+    def __init__(self, step: Timestep, user: int) -> None:
+        self._step = step
+        self._user = user
+        self._cache: dict[str, t.Any] = {}
+
+    def __getitem__(self, field: str) -> t.Any:
+        if field in self._cache:
+            return self._cache[field]
+        try:
+            j = self._step.fields.index(field)
+        except ValueError:
+            raise KeyError(field) from None
+        start, end = self._step._span(self._user, j)
+        if start == end:
+            raise KeyError(field)
+
+        value = self._cache[field] = self._step._decode(start, end)
+        return value
+
+    def __iter__(self) -> t.Iterator[str]:
+        for j, field in enumerate(self._step.fields):
+            start, end = self._step._span(self._user, j)
+            if start != end:
+                yield field
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+
+class csr:
+    """
+    Normalised time step layout: `{step}.csr/` stores each post once, and who saw,
+    posted and liked it as integer adjacency arrays, instead of repeating the post
+    under every follower's `seen`.
+
+    - `posts.arrow`: Arrow IPC table with a `uri` column plus the post's fields
+      (`createdAt`, `labels`, `text`, ...)
+    - `users.arrow`: the user `did`s, in the order of the `.json` file
+    - `{kind}.indptr.npy`, `{kind}.indices.npy`: CSR arrays per kind in `KINDS`;
+      user `i`'s posts are `indices[indptr[i]:indptr[i + 1]]` (rows of `posts`)
+    - `meta.json`: the fields each kind's entries had, to rebuild them
+    """
+
+    KINDS = ("seen", "posted", "liked")
+
+    @classmethod
+    def write(cls, path: str, activity: t.Mapping[str, t.Mapping[str, t.Any]]) -> None:
+        post_ids: dict[str, int] = {}
+        posts: list[dict[str, t.Any]] = []
+        fields: dict[str, dict[str, None]] = {kind: {} for kind in cls.KINDS}
+        indptr = {kind: np.zeros(len(activity) + 1, np.int64) for kind in cls.KINDS}
+        indices: dict[str, list[int]] = {kind: [] for kind in cls.KINDS}
+
+        for i, user in enumerate(activity.values()):
+            for kind in cls.KINDS:
+                for uri, record in user.get(kind, {}).items():
+                    j = post_ids.get(uri)
+                    if j is None:
+                        j = post_ids[uri] = len(posts)
+                        posts.append({"uri": uri, **record})
+                    elif not record.keys() <= posts[j].keys():
+                        # e.g. `text` is only kept under `posted`
+                        posts[j] = {**record, **posts[j]}
+                    fields[kind].update(dict.fromkeys(record))
+                    indices[kind].append(j)
+                indptr[kind][i + 1] = len(indices[kind])
+
+        tmp_path = f"{path}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        names = dict.fromkeys(k for post in posts for k in post) or {"uri": None}
+        table = pa.table({k: pa.array([post.get(k) for post in posts]) for k in names})
+        cls._write_table(f"{tmp_path}/posts.arrow", table)
+        cls._write_table(
+            f"{tmp_path}/users.arrow", pa.table({"did": pa.array(list(activity))})
+        )
+        for kind in cls.KINDS:
+            np.save(f"{tmp_path}/{kind}.indptr.npy", indptr[kind])
+            np.save(f"{tmp_path}/{kind}.indices.npy", np.array(indices[kind], np.int32))
+        with open(f"{tmp_path}/meta.json", "w") as f:
+            json.dump({"fields": {kind: list(fields[kind]) for kind in cls.KINDS}}, f)
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _write_table(path: str, table: pa.Table) -> None:
+        with pa.OSFile(path, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+
+    @classmethod
+    def convert(
+        cls, net_path: str, out_path: t.Optional[str] = None, log: bool = True
+    ) -> None:
+        """Write a `.csr` for each `{step}.json` in `net_path` (or `out_path`)."""
+        _convert_steps(net_path, out_path or net_path, ".csr", cls.write, log)
+
+    @classmethod
+    def load(
+        cls, path: str, columns: t.Optional[t.Collection[str]] = None
+    ) -> "PostGraph":
+        return PostGraph(path, columns)
+
+
+class PostGraph(t.Mapping[str, UserActivity]):
+    """
+    `{did: activity}` mapping over a `.csr` time step.
+
+    The arrays are memory-mapped: `posts` (Arrow table), and `indptr[kind]` /
+    `indices[kind]` for vectorised models. A user's `UserActivity` is rebuilt from
+    them when looked up, with only the post fields in `columns` (by default those
+    of a `LabeledRecord`; e.g. add `text` to get it back under `posted`). Each
+    column is converted to Python the first time a lookup needs it.
+    """
+
+    COLUMNS = ("createdAt", "labels")
+
+    def __init__(
+        self, path: str, columns: t.Optional[t.Collection[str]] = None
+    ) -> None:
+        self.path = path
+        self.posts = pa.ipc.open_file(pa.memory_map(f"{path}/posts.arrow")).read_all()
+        self.users = pa.ipc.open_file(pa.memory_map(f"{path}/users.arrow")).read_all()
+
+        self.indptr: dict[str, np.ndarray] = {}
+        self.indices: dict[str, np.ndarray] = {}
+        for kind in csr.KINDS:
+            self.indptr[kind] = np.load(f"{path}/{kind}.indptr.npy", mmap_mode="r")
+            self.indices[kind] = np.load(f"{path}/{kind}.indices.npy", mmap_mode="r")
+
+        with open(f"{path}/meta.json") as f:
+            fields: dict[str, list[str]] = json.load(f)["fields"]
+        self.columns = set(self.COLUMNS if columns is None else columns)
+        self.fields = {
+            kind: [f for f in names if f in self.columns]
+            for kind, names in fields.items()
+        }
+        self._ids: t.Optional[dict[str, int]] = None
+        self._columns: dict[str, list] = {}
+
+    def __getitem__(self, did: str) -> UserActivity:
+        if self._ids is None:
+            self._ids = {d: i for i, d in enumerate(self.dids)}
+        i = self._ids[did]
+        uris = self._column("uri")
+
+        activity = {}
+        for kind in csr.KINDS:
+            columns = [(f, self._column(f)) for f in self.fields[kind]]
+            rows = self.indices[kind][self.indptr[kind][i] : self.indptr[kind][i + 1]]
+            activity[kind] = {
+                uris[j]: {f: col[j] for f, col in columns if col[j] is not None}
+                for j in rows.tolist()
+            }
+        return activity  # type: ignore
+
+    def __iter__(self) -> t.Iterator[str]:
+        return iter(self.dids)
+
+    def __len__(self) -> int:
+        return self.users.num_rows
+
+    @cached_property
+    def dids(self) -> list[str]:
+        return self.users.column("did").to_pylist()
+
+    def user(self, row: int) -> UserActivity:
+        """The activity of the user in `row`, reading only that user's posts."""
+        names = ["uri", *(c for c in self.posts.column_names if c in self.columns)]
+        posts_table = self.posts.select(names)
+        activity = {}
+        for kind in csr.KINDS:
+            rows = self.indices[kind][
+                self.indptr[kind][row] : self.indptr[kind][row + 1]
+            ]
+            posts = posts_table.take(pa.array(rows, pa.int32())).to_pylist()
+            activity[kind] = {
+                post["uri"]: {
+                    f: post[f] for f in self.fields[kind] if post[f] is not None
+                }
+                for post in posts
+            }
+        return activity  # type: ignore
+
+    def _column(self, name: str) -> list:
+        if name not in self._columns:
+            self._columns[name] = self.posts.column(name).to_pylist()
+        return self._columns[name]
+
+
+class _HashIndex:
+    """
+    Base of the indexes stored as memory-mapped arrays in a directory: entries are
+    sorted by the 64-bit hash of their key (`hashes.npy`), with one more array
+    per entry field in `COLUMNS`. Subclasses check the entries of a matching hash,
+    in case of collisions.
+    """
+
+    COLUMNS: tuple[str, ...] = ()
+
+    def _load(self, path: str) -> None:
+        self.hashes: np.ndarray = np.load(f"{path}/hashes.npy", mmap_mode="r")
+        for name in self.COLUMNS:
+            setattr(self, name, np.load(f"{path}/{name}.npy", mmap_mode="r"))
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(blake2b(key.encode(), digest_size=8).digest(), "little")
+
+    @classmethod
+    def _save(
+        cls,
+        path: str,
+        hash_chunks: list[np.ndarray],
+        chunks: dict[str, list[np.ndarray]],
+    ) -> None:
+        hash_arr = (
+            np.concatenate(hash_chunks) if hash_chunks else np.array([], np.uint64)
+        )
+        order = np.argsort(hash_arr, kind="stable")
+        os.makedirs(path, exist_ok=True)
+        np.save(f"{path}/hashes.npy", hash_arr[order])
+        for name in cls.COLUMNS:
+            np.save(f"{path}/{name}.npy", np.concatenate(chunks[name] or [[]])[order])
+
+    def _rows(self, key: str) -> t.Iterator[int]:
+        """Entries whose hash matches `key`'s."""
+        target = np.uint64(self._hash(key))
+        i = int(np.searchsorted(self.hashes, target))
+        while i < len(self.hashes) and self.hashes[i] == target:
+            yield i
+            i += 1
+
+
+class UserIndex(_HashIndex):
+    """
+    did -> (time step, position) index over a `BskyNet`, stored in
+    `{net_path}/.user-index/` as memory-mapped arrays sorted by 64-bit did hash
+    (then by step).
+
+    Users are read without loading a step's did list. `offsets` and `sizes` are
+    the byte range of the user's activity in `.json` and `.bsn` steps (`masks`
+    says which of the step's `fields` a `.bsn` user has), and `offsets` is the
+    user's row in `.csr` steps. Entries are checked with a second, independent
+    hash of the did (`checks`), in case of collisions. The index is stale once a
+    step is added, removed or rewritten (its size or mtime changes).
+    """
+
+    COLUMNS = ("checks", "step_ids", "offsets", "sizes", "masks")
+    checks: np.ndarray
+    step_ids: np.ndarray
+    offsets: np.ndarray
+    sizes: np.ndarray
+    masks: np.ndarray
+
+    def __init__(self, net: "BskyNet") -> None:
+        self.net = net
+        path = self.path_for(net.path)
+        self._load(path)
+        with open(f"{path}/fields.json") as f:
+            self.fields: list[t.Optional[list[str]]] = json.load(f)
+
+    @classmethod
+    def load(cls, net: "BskyNet") -> t.Optional["UserIndex"]:
+        """Load the index of `net`, or `None` if it is missing or stale."""
+        path = cls.path_for(net.path)
+        if not os.path.exists(f"{path}/fields.json"):
+            return None
+        with open(f"{path}/files.json") as f:
+            if json.load(f) != net._sources():
+                return None
+        return cls(net)
+
+    @staticmethod
+    def path_for(net_path: str) -> str:
+        return f"{net_path}/.user-index"
+
+    @staticmethod
+    def _check(did: str) -> int:
+        digest = blake2b(did.encode(), digest_size=8, person=b"check").digest()
+        return int.from_bytes(digest, "little")
+
+    @classmethod
+    def build(cls, net: "BskyNet", log: bool = True) -> "UserIndex":
+        """Index every user's position in every time step of `net`."""
+        # Taken first, so a step rewritten while it's read leaves the index stale
+        sources = net._sources()
+        hash_chunks: list[np.ndarray] = []
+        chunks: dict[str, list[np.ndarray]] = {name: [] for name in cls.COLUMNS}
+        step_fields: list[t.Optional[list[str]]] = []
+
+        for i, name in enumerate(tq(net.files, active=log)):
+            path = f"{net.path}/{name}"
+            fields = None
+            if name.endswith(".json"):
+                with open(path, "rb") as f:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                        dids, starts, ends = cls._json_spans(mm)
+                offsets, sizes = starts, ends - starts
+                masks = np.zeros(len(dids), np.uint64)
+            elif name.endswith(".bsn"):
+                step = bsn.load(path)
+                dids, fields = step.dids, step.fields
+                offsets, sizes, masks = step._user_spans()
+                step.close()
+            else:
+                graph = csr.load(path)
+                dids = graph.dids
+                offsets, sizes = np.arange(len(dids)), np.zeros(len(dids), np.int64)
+                masks = np.zeros(len(dids), np.uint64)
+
+            hash_chunks.append(np.fromiter(map(cls._hash, dids), np.uint64, len(dids)))
+            chunks["checks"].append(
+                np.fromiter(map(cls._check, dids), np.uint64, len(dids))
+            )
+            chunks["step_ids"].append(np.full(len(dids), i, dtype=np.int32))
+            chunks["offsets"].append(offsets.astype(np.int64))
+            chunks["sizes"].append(sizes.astype(np.int64))
+            chunks["masks"].append(masks.astype(np.uint64))
+            step_fields.append(fields)
+
+        path = cls.path_for(net.path)
+        cls._save(path, hash_chunks, chunks)
+        with open(f"{path}/fields.json", "w") as f:
+            json.dump(step_fields, f)
+        with open(f"{path}/files.json", "w") as f:
+            json.dump(sources, f)
+        return cls(net)
+
+    @staticmethod
+    def _json_spans(buf: t.Any) -> tuple[list[str], np.ndarray, np.ndarray]:
+        """
+        Keys of a JSON object of objects, and the byte ranges of their values.
+
+        Only quotes and brackets are looked at (vectorised): a bracket counts if
+        it's outside a string, which is the case after an even number of
+        unescaped quotes.
+        """
+        arr = np.frombuffer(buf, np.uint8)
+        pos = np.flatnonzero(
+            (arr == 34) | (arr == 123) | (arr == 125) | (arr == 91) | (arr == 93)
+        )
+        chars = arr[pos]
+        quote = chars == 34
+
+        # Drop quotes escaped by an odd number of backslashes
+        for k in np.flatnonzero(quote & (arr[np.maximum(pos - 1, 0)] == 92)):
+            p, run = int(pos[k]) - 1, 0
+            while p >= 0 and arr[p] == 92:
+                run, p = run + 1, p - 1
+            quote[k] = run % 2 == 0
+
+        in_string = (np.cumsum(quote) - quote) % 2 == 1
+        bracket = ~quote & ~in_string
+        delta = np.zeros(len(pos), np.int64)
+        delta[bracket & ((chars == 123) | (chars == 91))] = 1
+        delta[bracket & ((chars == 125) | (chars == 93))] = -1
+        depth = np.cumsum(delta)
+
+        starts = pos[(delta == 1) & (depth == 2)]
+        ends = pos[(delta == -1) & (depth == 1)] + 1
+        key_open = np.flatnonzero(quote & ~in_string & (depth == 1))
+        quotes = np.flatnonzero(quote)
+        key_close = quotes[np.searchsorted(quotes, key_open, side="right")]
+        keys = [
+            json.loads(buf[a : b + 1])
+            for a, b in zip(pos[key_open].tolist(), pos[key_close].tolist())
+        ]
+        return keys, starts, ends
+
+    def history(self, did: str) -> list[tuple[int, UserActivity]]:
+        """`(i, activity)` for each time step `did` was active in."""
+        check = self._check(did)
+        history = []
+        for row in self._rows(did):
+            if int(self.checks[row]) == check:
+                i = int(self.step_ids[row])
+                history.append((i, self._read(i, row)))
+        return history
+
+    def _read(self, i: int, row: int) -> UserActivity:
+        path = f"{self.net.path}/{self.net.files[i]}"
+        offset, size = int(self.offsets[row]), int(self.sizes[row])
+        if path.endswith(".csr"):
+            return t.cast(PostGraph, self.net._load_step(i)).user(offset)
+
+        with open(path, "rb") as f:
+            f.seek(offset)
+            data = f.read(size)
+        if path.endswith(".json"):
+            return json.loads(data)
+
+        # A .bsn user's fields are consecutive msgpack objects
+        fields = self.fields[i] or []
+        mask = int(self.masks[row])
+        present = [field for j, field in enumerate(fields) if mask >> j & 1]
+        unpacker = msgpack.Unpacker()
+        unpacker.feed(data)
+        return dict(zip(present, unpacker))  # type: ignore
+
+
+# === Iteration utils ===
+
+
+class ZstFile:
+    """
+    Read-only view of a zstd-compressed JSONL file, with the same `readline`,
+    `find`, `seek`/`tell` and slicing interface as the `mmap` used for plain
+    files.
+
+    Files written by `zst.compress` are a series of independent frames holding
+    whole lines, followed by a seek table (the zstd seekable format). Offsets are
+    positions in the decompressed data, and reading a range only decompresses
+    the frames that overlap it. Files without a seek table can only be read
+    sequentially.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._dctx = zstandard.ZstdDecompressor()
+
+        # Bounds of each frame, compressed and decompressed
+        self.frames: t.Optional[list[int]] = None
+        self.offsets: t.Optional[list[int]] = None
+        self._read_seek_table()
+
+        self._frame = -1
+        self._data = b""
+        self._pos = 0
+        self._stream: t.Optional[t.IO[bytes]] = None
+
+    def _read_seek_table(self) -> None:
+        mm = self._mm
+        if len(mm) < 9:
+            return
+
+        n_frames, descriptor, magic = struct.unpack("<IBI", mm[-9:])
+        if magic != zst.SEEKABLE_MAGIC:
+            return
+
+        entry_size = 12 if descriptor & 0x80 else 8
+        table_end = len(mm) - 9
+        table = np.frombuffer(
+            mm[table_end - n_frames * entry_size : table_end], dtype="<u4"
+        ).reshape(n_frames, entry_size // 4)
+
+        self.frames = [0, *np.cumsum(table[:, 0], dtype=np.int64).tolist()]
+        self.offsets = [0, *np.cumsum(table[:, 1], dtype=np.int64).tolist()]
+
+    def close(self) -> None:
+        if self._stream is not None:
+            self._stream.close()
+        self._mm.close()
+        self._file.close()
+
+    def __enter__(self) -> "ZstFile":
+        return self
+
+    def __exit__(self, *exc: t.Any) -> None:
+        self.close()
+
+    def _offsets(self) -> list[int]:
+        if self.offsets is None:
+            raise ValueError(
+                f"{self.path} has no seek table, recompress it with zst.compress"
+            )
+        return self.offsets
+
+    def __len__(self) -> int:
+        return self._offsets()[-1]
+
+    def frame(self, i: int) -> bytes:
+        """Decompressed contents of frame `i` (the last frame read is cached)."""
+        if i != self._frame:
+            assert self.frames is not None
+            self._data = self._dctx.decompress(
+                self._mm[self.frames[i] : self.frames[i + 1]]
+            )
+            self._frame = i
+        return self._data
+
+    def __getitem__(self, key: slice) -> bytes:
+        offsets = self._offsets()
+        start, stop, _ = key.indices(offsets[-1])
+
+        chunks = []
+        i = bisect_right(offsets, start) - 1
+        while start < stop and i < len(offsets) - 1:
+            data = self.frame(i)
+            chunks.append(data[start - offsets[i] : stop - offsets[i]])
+            start = offsets[i + 1]
+            i += 1
+        return b"".join(chunks)
+
+    def find(self, sub: bytes, start: int = 0) -> int:
+        """Like `mmap.find`, for a `sub` that doesn't span frames (e.g. b"\\n")."""
+        offsets = self._offsets()
+        i = max(bisect_right(offsets, start) - 1, 0)
+        while i < len(offsets) - 1:
+            pos = self.frame(i).find(sub, max(start - offsets[i], 0))
+            if pos != -1:
+                return offsets[i] + pos
+            i += 1
+        return -1
+
+    def seek(self, pos: int) -> None:
+        self._offsets()
+        self._pos = pos
+
+    def tell(self) -> int:
+        return self._pos
+
+    def readline(self) -> bytes:
+        if self.offsets is None:
+            if self._stream is None:
+                self._stream = io.BufferedReader(
+                    self._dctx.stream_reader(self._mm, read_across_frames=True)
+                )
+            return self._stream.readline()
+
+        offsets = self.offsets
+        pos = self._pos
+        if pos >= offsets[-1]:
+            return b""
+
+        i = self._frame
+        if not (i >= 0 and offsets[i] <= pos < offsets[i + 1]):
+            i = bisect_right(offsets, pos) - 1
+        data = self.frame(i)
+
+        local = pos - offsets[i]
+        newline = data.find(b"\n", local)
+        end = len(data) if newline == -1 else newline + 1
+        self._pos = offsets[i] + end
+        return data[local:end]
+
+
+class zst:
+    """Writer for the seekable zstd files read by `ZstFile`."""
+
+    SKIPPABLE_MAGIC = 0x184D2A5E
+    SEEKABLE_MAGIC = 0x8F92EAB1
+
+    @classmethod
+    def compress(
+        cls,
+        src_path: str,
+        dst_path: t.Optional[str] = None,
+        frame_bytes: int = 4 * 1024 * 1024,
+        level: int = 3,
+    ) -> str:
+        """
+        Compress a JSONL file into frames of about `frame_bytes` of whole lines,
+        followed by a seek table. Writes to `{src_path}.zst` by default.
+        """
+        dst_path = dst_path or f"{src_path}.zst"
+        cctx = zstandard.ZstdCompressor(level=level)
+        sizes: list[tuple[int, int]] = []
+
+        with open(src_path, "rb") as src, open(dst_path, "wb") as dst:
+
+            def write_frame(lines: list[bytes]) -> None:
+                data = b"".join(lines)
+                frame = cctx.compress(data)
+                dst.write(frame)
+                sizes.append((len(frame), len(data)))
+
+            lines: list[bytes] = []
+            n_bytes = 0
+            for line in src:
+                lines.append(line)
+                n_bytes += len(line)
+                if n_bytes >= frame_bytes:
+                    write_frame(lines)
+                    lines, n_bytes = [], 0
+            if lines:
+                write_frame(lines)
+
+            table = b"".join(struct.pack("<II", c, d) for c, d in sizes)
+            table += struct.pack("<IBI", len(sizes), 0, cls.SEEKABLE_MAGIC)
+            dst.write(struct.pack("<II", cls.SKIPPABLE_MAGIC, len(table)) + table)
+
+        return dst_path
+
+
+class LineIndex:
+    """
+    Sidecar index of a JSONL file, stored next to it as `{path}.idx.npz`.
+
+    Holds the byte offset of every line, plus the line numbers grouped by `$type`
+    and by DID (as CSR `order`/`ptr` arrays over the sorted names), so readers
+    can seek straight to the lines they need.
+    """
+
+    def __init__(self, arrays: t.Mapping[str, np.ndarray]) -> None:
+        self.offsets: np.ndarray = arrays["offsets"]
+        self.type_names: np.ndarray = arrays["type_names"]
+        self.type_order: np.ndarray = arrays["type_order"]
+        self.type_ptr: np.ndarray = arrays["type_ptr"]
+        self.did_names: np.ndarray = arrays["did_names"]
+        self.did_order: np.ndarray = arrays["did_order"]
+        self.did_ptr: np.ndarray = arrays["did_ptr"]
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    @staticmethod
+    def path_for(path: str) -> str:
+        return f"{path}.idx.npz"
+
+    @staticmethod
+    def _stat(path: str) -> np.ndarray:
+        stat = os.stat(path)
+        return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+    @classmethod
+    def build(cls, path: str) -> "LineIndex":
+        offsets = [0]
+        type_codes: dict[str, int] = {}
+        did_codes: dict[str, int] = {}
+        line_types: list[int] = []
+        line_dids: list[int] = []
+
+        path = jsonl.resolve(path)
+        with jsonl.open(path) as buf:
+            for line in iter(buf.readline, b""):
+                offsets.append(offsets[-1] + len(line))
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    record = {}
+                rtype = record.get("$type", "")
+                did = record.get("did", "")
+                line_types.append(type_codes.setdefault(rtype, len(type_codes)))
+                line_dids.append(did_codes.setdefault(did, len(did_codes)))
+
+        type_names, type_order, type_ptr = cls._group(type_codes, line_types)
+        did_names, did_order, did_ptr = cls._group(did_codes, line_dids)
+
+        arrays = {
+            "offsets": np.array(offsets, dtype=np.int64),
+            "type_names": type_names,
+            "type_order": type_order,
+            "type_ptr": type_ptr,
+            "did_names": did_names,
+            "did_order": did_order,
+            "did_ptr": did_ptr,
+        }
+        np.savez(cls.path_for(path), stat=cls._stat(path), **arrays)
+        return cls(arrays)
+
+    @staticmethod
+    def _group(
+        codes: dict[str, int], line_codes: list[int]
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Sort names and return `(names, line numbers by name, name offsets)`."""
+        names = np.array(list(codes), dtype=str)
+        rank = np.empty(len(names), dtype=np.int64)
+        rank[np.argsort(names, kind="stable")] = np.arange(len(names))
+
+        by_line = rank[np.array(line_codes, dtype=np.int64)]
+        order = np.argsort(by_line, kind="stable").astype(np.int64)
+        counts = np.bincount(by_line, minlength=len(names))
+        ptr = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        return np.sort(names), order, ptr
+
+    @classmethod
+    def load(cls, path: str) -> t.Optional["LineIndex"]:
+        """Load the index for `path`, or `None` if it is missing or stale."""
+        path = jsonl.resolve(path)
+        index_path = cls.path_for(path)
+        if not os.path.exists(index_path):
+            return None
+
+        arrays = dict(np.load(index_path))
+        if not np.array_equal(arrays.pop("stat"), cls._stat(path)):
+            return None
+        return cls(arrays)
+
+    def lines(
+        self,
+        types: t.Optional[t.Collection[str]] = None,
+        dids: t.Optional[t.Collection[str]] = None,
+    ) -> np.ndarray:
+        """Sorted line numbers of records matching both `types` and `dids`."""
+        selected = np.arange(len(self))
+        if types is not None:
+            selected = self._select(
+                self.type_names, self.type_order, self.type_ptr, types
+            )
+        if dids is not None:
+            selected = np.intersect1d(
+                selected,
+                self._select(self.did_names, self.did_order, self.did_ptr, dids),
+            )
+        return selected
+
+    @staticmethod
+    def _select(
+        names: np.ndarray, order: np.ndarray, ptr: np.ndarray, keys: t.Collection[str]
+    ) -> np.ndarray:
+        keys_arr = np.array(list(keys), dtype=str)
+        idx = np.searchsorted(names, keys_arr)
+        found = idx < len(names)
+        found[found] = names[idx[found]] == keys_arr[found]
+
+        groups = [order[ptr[i] : ptr[i + 1]] for i in idx[found]]
+        if not groups:
+            return np.array([], dtype=np.int64)
+        return np.sort(np.concatenate(groups))
+
+
+class UriIndex(_HashIndex):
+    """
+    URI -> (day, line) index over a daily stream, stored in `{stream_path}/.uri-index/`
+    as memory-mapped arrays sorted by 64-bit URI hash.
+
+    Lookups read the record with `jsonl.get`, so the days need `LineIndex`es.
+    """
+
+    COLUMNS = ("day_ids", "lines")
+    day_ids: np.ndarray
+    lines: np.ndarray
+
+    def __init__(self, stream_path: str) -> None:
+        self.stream_path = stream_path
+        path = self.path_for(stream_path)
+        with open(f"{path}/days.json") as f:
+            self.days: list[str] = json.load(f)
+        self._load(path)
+
+    @staticmethod
+    def path_for(stream_path: str) -> str:
+        return f"{stream_path}/.uri-index"
+
+    @classmethod
+    def build(
+        cls,
+        stream_path: str,
+        start_date: str = "2022-11-17",
+        end_date: str = "2023-07-01",
+        types: t.Optional[t.Collection[str]] = ("app.bsky.feed.post",),
+        log: bool = True,
+    ) -> "UriIndex":
+        """Index the URIs of records with `types` (None for all records)."""
+        days = generate_timestamps(start_date, end_date)
+        hash_chunks: list[np.ndarray] = []
+        day_chunks: list[np.ndarray] = []
+        line_chunks: list[np.ndarray] = []
+
+        for day_id, day in enumerate(tq(days, active=log)):
+            path = f"{stream_path}/{day}.jsonl"
+            hashes: list[int] = []
+            lines: list[int] = []
+            # Lazy records are yielded for every line, so `i` is the line number
+            for i, record in enumerate(jsonl[LazyRecord].iter(path, lazy=True)):
+                try:
+                    if types is not None and record.get("$type") not in types:
+                        continue
+                    uri = record.get("uri")
+                except json.JSONDecodeError:
+                    continue
+                if isinstance(uri, str):
+                    hashes.append(cls._hash(uri))
+                    lines.append(i)
+
+            hash_chunks.append(np.array(hashes, dtype=np.uint64))
+            line_chunks.append(np.array(lines, dtype=np.int64))
+            day_chunks.append(np.full(len(lines), day_id, dtype=np.int32))
+
+        path = cls.path_for(stream_path)
+        cls._save(path, hash_chunks, {"day_ids": day_chunks, "lines": line_chunks})
+        with open(f"{path}/days.json", "w") as f:
+            json.dump(days, f)
+        return cls(stream_path)
+
+    def locate(self, uri: str) -> t.Optional[tuple[str, int]]:
+        """`(day, line number)` of the record with `uri`, or None."""
+        for day, line_no in self._candidates(uri):
+            if jsonl.get(f"{self.stream_path}/{day}.jsonl", line_no).get("uri") == uri:
+                return day, line_no
+        return None
+
+    def get(self, uri: str, raw: bool = False) -> t.Any:
+        """The record with `uri` (see `jsonl.get`), or None."""
+        for day, line_no in self._candidates(uri):
+            path = f"{self.stream_path}/{day}.jsonl"
+            record = jsonl.get(path, line_no)
+            if record.get("uri") == uri:
+                return jsonl.get(path, line_no, raw=True) if raw else record
+        return None
+
+    def _candidates(self, uri: str) -> t.Iterator[tuple[str, int]]:
+        # Equal hashes are checked against the record, in case of collisions
+        for row in self._rows(uri):
+            yield self.days[int(self.day_ids[row])], int(self.lines[row])
+
+
+class LazyRecord(t.Mapping[str, t.Any]):
+    """
+    A JSONL line that is only decoded when needed, keeping the original bytes in
+    `raw` (e.g. to write the line out unchanged).
+
+    `$type` is sliced straight out of lines of at least `SCAN_MIN_BYTES` (when it
+    sits directly in the top-level object), so type checks on long records skip
+    decoding them. Reading any other field decodes the line once with ujson:
+    scanning for several fields, or in short lines, is slower than decoding.
+    """
+
+    __slots__ = ("raw", "_type", "_decoded")
+
+    # Shorter lines decode faster than they can be scanned
+    SCAN_MIN_BYTES = 512
+    _TYPE = re.compile(rb'"\$type": ?"([^"\\]*)"')
+
+    def __init__(self, raw: bytes) -> None:
+        self.raw = raw
+        self._type: t.Optional[str] = None
+        self._decoded: t.Optional[dict] = None
+
+    def __getitem__(self, key: str) -> t.Any:
+        decoded = self._decoded
+        if decoded is not None:
+            return decoded[key]
+        if key == "$type" and self._scanned_type() is not None:
+            return self._type
+        return self.decode()[key]
+
+    def get(self, key: str, default: t.Any = None) -> t.Any:
+        decoded = self._decoded
+        if decoded is None:
+            if key == "$type" and self._scanned_type() is not None:
+                return self._type
+            decoded = self.decode()
+        return decoded.get(key, default)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self.decode()
+
+    def __iter__(self) -> t.Iterator[str]:
+        return iter(self.decode())
+
+    def __len__(self) -> int:
+        return len(self.decode())
+
+    def __repr__(self) -> str:
+        return f"LazyRecord({self.decode()!r})"
+
+    def decode(self) -> dict:
+        """Decode (and cache) the full object."""
+        if self._decoded is None:
+            self._decoded = json.loads(self.raw)
+        return self._decoded
+
+    def _scanned_type(self) -> t.Optional[str]:
+        if self._type is None and len(self.raw) >= self.SCAN_MIN_BYTES:
+            self._type = self._scan_type()
+        return self._type
+
+    def _scan_type(self) -> t.Optional[str]:
+        raw = self.raw
+        match = self._TYPE.search(raw)
+        # Only trust a match directly in the top-level object (not e.g. `embed`)
+        if match is None or raw.find(b"{", 1, match.start()) != -1:
+            return None
+        if raw.find(b"[", 1, match.start()) != -1:
+            return None
+        return match.group(1).decode()
+
+
+class jsonl[T]:
+    # Most files kept open (mmapped, with their `LineIndex`) for `get`
+    MAX_OPEN = 32
+    _handles: "OrderedDict[str, tuple[t.Any, t.Union[mmap.mmap, ZstFile], LineIndex]]" = OrderedDict()
+
+    @classmethod
+    def get(cls, path: str, line_no: int, raw: bool = False) -> t.Any:
+        """
+        Decode line `line_no` of a file, seeking to it with the file's `LineIndex`.
+
+        With `raw=True`, return the line as a zero-copy `memoryview` of the mmap
+        (bytes for compressed files). Recently used files stay open, so repeated
+        lookups cost microseconds.
+        """
+        buf, index = cls._handle(path)
+        if not 0 <= line_no < len(index):
+            raise IndexError(f"Line {line_no} out of range for {path}")
+
+        start, end = int(index.offsets[line_no]), int(index.offsets[line_no + 1])
+        if isinstance(buf, mmap.mmap):
+            line: t.Union[memoryview, bytes] = memoryview(buf)[start:end]
+        else:
+            line = buf[start:end]
+        return line if raw else json.loads(bytes(line))
+
+    @classmethod
+    def _handle(cls, path: str) -> tuple[t.Union[mmap.mmap, ZstFile], LineIndex]:
+        path = cls.resolve(path)
+        if path in cls._handles:
+            cls._handles.move_to_end(path)
+            _, buf, index = cls._handles[path]
+            return buf, index
+
+        index = LineIndex.load(path)
+        if index is None:
+            raise ValueError(
+                f"No up-to-date line index for {path}, see LineIndex.build"
+            )
+
+        if path.endswith(".zst"):
+            f: t.Any = None
+            buf: t.Union[mmap.mmap, ZstFile] = ZstFile(path)
+        else:
+            f = open(path, "rb")
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        cls._handles[path] = (f, buf, index)
+
+        while len(cls._handles) > cls.MAX_OPEN:
+            _, (old_f, old_buf, _) = cls._handles.popitem(last=False)
+            try:
+                old_buf.close()
+            except BufferError:
+                pass  # Views are still in use; the mmap closes once they're gone
+            if old_f is not None:
+                old_f.close()
+        return buf, index
+
+    @classmethod
+    def iter(
+        cls,
+        path: str,
+        types: t.Optional[t.Collection[str]] = None,
+        dids: t.Optional[t.Collection[str]] = None,
+        lazy: bool = False,
+    ) -> t.Generator[T, None, None]:
+        """
+        Yield the decoded lines of a JSONL file.
+
+        `types` and `dids` keep only records with those `$type`s / DIDs. If the
+        file has an up-to-date `LineIndex`, only the matching lines are read.
+        With `lazy=True`, lines are yielded as `LazyRecord`s; malformed lines
+        then only raise once a field is read.
+        """
+        for batch in cls.iter_batches(path, 4096, types=types, dids=dids, lazy=lazy):
+            yield from batch
+
+    @classmethod
+    async def aiter(
+        cls,
+        path: str,
+        types: t.Optional[t.Collection[str]] = None,
+        dids: t.Optional[t.Collection[str]] = None,
+        lazy: bool = False,
+        depth: int = 2,
+    ) -> t.AsyncGenerator[T, None]:
+        """
+        `iter` for `async for`: lines are read and decoded in a background thread,
+        up to `depth` batches ahead, so the event loop is free in the meantime.
+        """
+        batches = cls.iter_batches(path, 4096, types=types, dids=dids, lazy=lazy)
+        async for batch in aiterate(batches, depth):
+            for record in batch:
+                yield record
+
+    @classmethod
+    def iter_batches(
+        cls,
+        path: str,
+        size: int,
+        types: t.Optional[t.Collection[str]] = None,
+        dids: t.Optional[t.Collection[str]] = None,
+        lazy: bool = False,
+        arrow: bool = False,
+        schema: t.Optional[pa.Schema] = None,
+        metrics: t.Optional["Metrics"] = None,
+    ) -> t.Generator[t.Any, None, None]:
+        """
+        Yield the records of a JSONL file in lists of up to `size`.
+
+        With `arrow=True`, batches are `pyarrow.RecordBatch`es instead. Given a
+        `schema`, lines are parsed straight into those columns by Arrow's JSON
+        reader (other fields are skipped); otherwise the schema is inferred from
+        the decoded records. Either way, each field needs one shape across the
+        batch (e.g. `subject` is a string for follows and an object for likes), so
+        pass `types` when mixing record types.
+
+        Each batch's records and line bytes are added to `metrics`, if given.
+        """
+        path = cls.resolve(path)
+        filtered = types is not None or dids is not None
+        index = LineIndex.load(path) if filtered else None
+        # Arrow needs plain values, so `lazy` only applies to lists
+        decode: t.Callable[[bytes], t.Any] = (
+            LazyRecord if lazy and not arrow else json.loads
+        )
+
+        with cls.open(path) as buf:
+            lines: t.Iterator[bytes]
+            if index is not None:
+                offsets = index.offsets.tolist()
+                lines = (
+                    buf[offsets[i] : offsets[i + 1]]
+                    for i in index.lines(types, dids).tolist()
+                )
+            else:
+                lines = iter(buf.readline, b"")
+
+            while batch := list(islice(lines, size)):
+                if arrow and schema is not None and (index is not None or not filtered):
+                    parsed = cls._parse_arrow(batch, schema)
+                    if metrics is not None:
+                        metrics.add_records(parsed, sum(map(len, batch)))
+                    yield parsed
+                    continue
+
+                out = cls._decode_batch(batch, decode)
+                if filtered and index is None:
+                    out = [r for r in out if cls._matches(r, types, dids)]
+                if metrics is not None:
+                    metrics.add_records(out, sum(map(len, batch)))
+                if out:
+                    yield to_record_batch(out, schema) if arrow else out
+
+    @staticmethod
+    def _decode_batch(lines: list[bytes], decode: t.Callable[[bytes], t.Any]) -> list:
+        try:
+            return [decode(line) for line in lines]
+        except json.JSONDecodeError:
+            out = []
+            for line in lines:
+                try:
+                    out.append(decode(line))
+                except json.JSONDecodeError:
+                    print(f"JSONDecodeError: {line}")
+            return out
+
+    @staticmethod
+    def _parse_arrow(lines: list[bytes], schema: pa.Schema) -> pa.RecordBatch:
+        data = b"".join(
+            line if line.endswith(b"\n") else line + b"\n" for line in lines
+        )
+        table = pa_json.read_json(
+            pa.BufferReader(data),
+            read_options=pa_json.ReadOptions(block_size=len(data) + 1),
+            parse_options=pa_json.ParseOptions(
+                explicit_schema=schema, unexpected_field_behavior="ignore"
+            ),
+        )
+        return table.combine_chunks().to_batches()[0]
+
+    @classmethod
+    def iter_parallel(
+        cls,
+        path: str,
+        workers: int,
+        chunk_bytes: int = 64 * 1024 * 1024,
+        types: t.Optional[t.Collection[str]] = None,
+        lazy: bool = False,
+        ordered: bool = True,
+    ) -> t.Generator[T, None, None]:
+        """
+        Yield the records of one (large) file, decoded by `workers` processes.
+
+        The file is split into newline-aligned `ranges` of `chunk_bytes`. Records
+        come out in file order, or chunk by chunk as they finish with
+        `ordered=False`.
+        """
+        tasks = (
+            (path, start, end, types, lazy)
+            for start, end in cls.ranges(path, chunk_bytes)
+        )
+        for chunk in pmap(_read_range, tasks, workers, ordered=ordered):
+            yield from chunk
+
+    @classmethod
+    def iter_between(
+        cls,
+        path: str,
+        start: t.Optional[str] = None,
+        end: t.Optional[str] = None,
+        types: t.Optional[t.Collection[str]] = None,
+        lazy: bool = False,
+        slack: timedelta = timedelta(minutes=5),
+        chronological: bool = False,
+    ) -> t.Generator[T, None, None]:
+        """
+        Yield records with `start <= createdAt < end` (ISO timestamps). Records
+        without a readable `createdAt` are kept. Uses the `LineIndex` when there
+        is one.
+
+        Daily stream files aren't ordered by `createdAt`, so by default the whole
+        file is scanned. With `chronological=True` (files sorted by `createdAt`,
+        see `chron.convert`), `start` is found by binary search over the lines,
+        aiming `slack` before it, and reading stops at the first record more than
+        `slack` past `end`.
+        """
+        path = cls.resolve(path)
+        start_us = timestamp_us(start) if start else None
+        end_us = timestamp_us(end) if end else None
+        slack_us = int(slack.total_seconds() * 1_000_000)
+
+        index = LineIndex.load(path)
+        decode: t.Callable[[bytes], t.Any] = LazyRecord if lazy else json.loads
+
+        with cls.open(path) as buf:
+            lines: t.Iterable[bytes]
+            if index is not None:
+                offsets = index.offsets.tolist()
+                first = 0
+                if chronological and start_us is not None:
+                    first = bisect_left(
+                        range(len(index)),
+                        start_us - slack_us,
+                        key=lambda i: cls._line_time(buf[offsets[i] : offsets[i + 1]]),
+                    )
+                selected = index.lines(types)
+                selected = selected[selected >= first].tolist()
+                lines = (buf[offsets[i] : offsets[i + 1]] for i in selected)
+            else:
+                if chronological and start_us is not None:
+                    buf.seek(cls._seek_time(buf, start_us - slack_us))
+                lines = iter(buf.readline, b"")
+
+            for line in lines:
+                try:
+                    record = decode(line)
+                    created = cls._record_time(record)
+                except json.JSONDecodeError:
+                    print(f"JSONDecodeError: {line}")
+                    continue
+
+                if created is not None:
+                    if end_us is not None and created >= end_us:
+                        if chronological and created >= end_us + slack_us:
+                            return
+                        continue
+                    if start_us is not None and created < start_us:
+                        continue
+                if types is not None and record["$type"] not in types:
+                    continue
+                yield record
+
+    @staticmethod
+    def _record_time(record: t.Mapping[str, t.Any]) -> t.Optional[int]:
+        try:
+            return timestamp_us(record["createdAt"])
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return None
+
+    @classmethod
+    def _line_time(cls, line: bytes) -> int:
+        """`createdAt` of a line for the binary search; unreadable lines sort first."""
+        try:
+            created = cls._record_time(json.loads(line))
+        except json.JSONDecodeError:
+            return -1
+        return -1 if created is None else created
+
+    @classmethod
+    def _seek_time(cls, buf: t.Union[mmap.mmap, ZstFile], target: int) -> int:
+        """Offset of a line start at or before the first line with time >= target."""
+        size = len(buf)
+        lo, hi = 0, size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            line_start = buf.find(b"\n", mid - 1) + 1 if mid > 0 else 0
+            if line_start == 0 and mid > 0:
+                break
+            if line_start >= hi:
                 break
-            with open(f"{self.path}/{time_step}", "rb") as f:
-                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
-                    yield i, json.loads(mm.read())
 
-    def _get_files(self):
-        return [f for f in sorted(os.listdir(self.path)) if f.endswith(".json")]
+            newline = buf.find(b"\n", line_start)
+            line_end = size if newline == -1 else newline + 1
+            if cls._line_time(buf[line_start:line_end]) < target:
+                lo = line_end
+            else:
+                hi = line_start
+        return lo
+
+    @staticmethod
+    def resolve(path: str) -> str:
+        """Fall back to `{path}.zst` when the uncompressed file doesn't exist."""
+        if not os.path.exists(path) and os.path.exists(f"{path}.zst"):
+            return f"{path}.zst"
+        return path
+
+    @staticmethod
+    @contextmanager
+    def open(path: str) -> t.Iterator[t.Union[mmap.mmap, ZstFile]]:
+        """Open a (possibly zstd-compressed) JSONL file for reading."""
+        if path.endswith(".zst"):
+            with ZstFile(path) as zf:
+                yield zf
+            return
+
+        with open(path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                yield mm
+
+    @staticmethod
+    def _matches(
+        record: t.Mapping[str, t.Any],
+        types: t.Optional[t.Collection[str]],
+        dids: t.Optional[t.Collection[str]],
+    ) -> bool:
+        if types is not None and record.get("$type") not in types:
+            return False
+        if dids is not None and record.get("did") not in dids:
+            return False
+        return True
+
+    @classmethod
+    def ranges(
+        cls, path: str, chunk_bytes: int = 64 * 1024 * 1024
+    ) -> list[tuple[int, int]]:
+        """
+        Split a file into `(start, end)` byte ranges of roughly `chunk_bytes`.
+
+        Every range starts at the beginning of a line and ends just after a newline
+        (or at EOF), so ranges can be decoded independently. Offsets of compressed
+        files are in the decompressed data and fall on frame boundaries.
+        """
+        path = cls.resolve(path)
+        if os.path.getsize(path) == 0:
+            return []
+
+        bounds = [0]
+        with cls.open(path) as buf:
+            size = len(buf)
+            if isinstance(buf, ZstFile):
+                # Compressed files are split on frame boundaries
+                assert buf.offsets is not None
+                for offset in buf.offsets[1:-1]:
+                    if offset - bounds[-1] >= chunk_bytes:
+                        bounds.append(offset)
+            else:
+                while bounds[-1] + chunk_bytes < size:
+                    newline = buf.find(b"\n", bounds[-1] + chunk_bytes)
+                    if newline == -1:
+                        break
+                    bounds.append(newline + 1)
+
+        if bounds[-1] != size:
+            bounds.append(size)
+
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    @classmethod
+    def read_range(
+        cls,
+        path: str,
+        start: int,
+        end: int,
+        types: t.Optional[t.Collection[str]] = None,
+        lazy: bool = False,
+        window: tuple[t.Optional[int], t.Optional[int]] = (None, None),
+        columns: t.Optional[list[str]] = None,
+    ) -> list[T]:
+        """
+        Decode the lines in `[start, end)` of a file, optionally by `$type`, and
+        by `createdAt` within `window` (epoch microseconds, end exclusive; records
+        without a readable `createdAt` are kept). With `columns`, records are
+        reduced to those fields (see `_project`).
+        """
+        path = cls.resolve(path)
+        index = LineIndex.load(path) if types is not None else None
+        decode: t.Callable[[bytes], t.Any] = LazyRecord if lazy else json.loads
+        lo, hi = window
+
+        lines: t.Iterable[bytes]
+        out: list[T] = []
+        with cls.open(path) as buf:
+            if index is not None:
+                selected = index.lines(types)
+                starts = index.offsets[selected]
+                selected = selected[(starts >= start) & (starts < end)]
+                offsets = index.offsets.tolist()
+                lines = (buf[offsets[i] : offsets[i + 1]] for i in selected.tolist())
+                types = None
+            else:
+                buf.seek(start)
+                lines = iter(lambda: buf.readline() if buf.tell() < end else b"", b"")
+
+            for line in lines:
+                try:
+                    record = decode(line)
+                    if types is not None and record["$type"] not in types:
+                        continue
+                    if lo is not None or hi is not None:
+                        created = cls._record_time(record)
+                        if created is not None and (
+                            (lo is not None and created < lo)
+                            or (hi is not None and created >= hi)
+                        ):
+                            continue
+                    out.append(
+                        record if columns is None else cls._project(record, columns)
+                    )
+                except json.JSONDecodeError:
+                    print(f"JSONDecodeError: {line}")
+                    continue
+        return out
+
+    @staticmethod
+    def _project(record: t.Mapping[str, t.Any], columns: list[str]) -> dict:
+        """
+        `$type` and the given fields of a record, in the shape `parquet.iter`
+        returns them: dotted columns (`subject.uri`) as nested dicts, missing
+        fields left out.
+        """
+        out: dict = {"$type": record.get("$type")}
+        for column in columns:
+            *parents, leaf = column.split(".")
+            value: t.Any = record
+            for part in column.split("."):
+                value = value.get(part) if isinstance(value, t.Mapping) else None
+            if value is None:
+                continue
+            node = out
+            for parent in parents:
+                node = node.setdefault(parent, {})
+            node[leaf] = value
+        return out
+
+
+def generate_timestamps(start_date: str, end_date: str) -> list[str]:
+    """Days from `start_date` to `end_date` (inclusive) as `%Y-%m-%d` strings."""
+    start_dt = datetime.strptime(start_date, "%Y-%m-%d")
+    end_dt = datetime.strptime(end_date, "%Y-%m-%d")
+    delta = end_dt - start_dt
+
+    return [
+        (start_dt + timedelta(days=i)).strftime("%Y-%m-%d")
+        for i in range(delta.days + 1)
+    ]
+
+
+def _read_range(task: tuple) -> list:
+    return jsonl.read_range(*task)
+
+
+def _read_range_batches(
+    task: tuple[tuple, int, t.Optional[pa.Schema]],
+) -> list[pa.RecordBatch]:
+    args, size, schema = task
+    return list(batched(jsonl.read_range(*args), size, True, schema))
+
+
+def pmap(
+    fn: t.Callable[[t.Any], T],
+    tasks: t.Iterable[t.Any],
+    workers: int,
+    window: t.Optional[int] = None,
+    ordered: bool = True,
+) -> t.Generator[T, None, None]:
+    """
+    Map `fn` over `tasks` in a process pool, yielding results in task order (or as
+    they finish with `ordered=False`).
+
+    At most `window` tasks (default `2 * workers`) are in flight at once, which
+    bounds memory to a few results per worker. `fn` must be picklable.
+    """
+    window = window or 2 * workers
+    tasks = iter(tasks)
+    pending: list[Future] = []
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        try:
+            for task in tasks:
+                pending.append(pool.submit(fn, task))
+                if len(pending) >= window:
+                    yield from _finished(pending, ordered)
+
+            while pending:
+                yield from _finished(pending, ordered)
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def _finished(pending: list[Future], ordered: bool) -> t.Generator[t.Any, None, None]:
+    """Take the results of the first pending future, or of any finished ones."""
+    if ordered:
+        yield pending.pop(0).result()
+        return
+
+    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+    for future in [f for f in pending if f in done]:
+        pending.remove(future)
+        yield future.result()
+
+
+def prefetched(iterable: t.Iterable[T], depth: int = 2) -> t.Generator[T, None, None]:
+    """
+    Iterate `iterable` in a background thread, keeping up to `depth` items ready.
+
+    The producer runs ahead while the caller works on the current item, so disk
+    reads (which release the GIL) overlap with the caller's CPU work. Memory is
+    bounded by `depth` items. Exceptions from the producer are re-raised here.
+    """
+    ready: queue.Queue = queue.Queue(maxsize=max(depth, 1))
+    stop = threading.Event()
+    done = object()
+
+    def put(item: t.Any) -> bool:
+        while not stop.is_set():
+            try:
+                ready.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce() -> None:
+        items = iter(iterable)
+        try:
+            for item in items:
+                if not put((item, None)):
+                    return
+            put((done, None))
+        except BaseException as e:
+            put((done, e))
+        finally:
+            if isinstance(items, t.Generator):
+                items.close()
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = ready.get()
+            if item is done:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+async def aiterate(
+    iterable: t.Iterable[T], depth: int = 2
+) -> t.AsyncGenerator[T, None]:
+    """
+    Iterate a blocking iterable from async code.
+
+    `iterable` runs in a background thread that keeps up to `depth` items in an
+    `asyncio.Queue`, so the event loop keeps serving other tasks while items are
+    read and decoded. Exceptions from the iterable are re-raised here.
+    """
+    loop = asyncio.get_running_loop()
+    ready: asyncio.Queue = asyncio.Queue(maxsize=max(depth, 1))
+    stop = threading.Event()
+    done = object()
+
+    def put(item: t.Any) -> bool:
+        try:
+            future = asyncio.run_coroutine_threadsafe(ready.put(item), loop)
+        except RuntimeError:  # Event loop closed
+            return False
+        while True:
+            try:
+                future.result(timeout=0.1)
+                return True
+            except TimeoutError:
+                if stop.is_set():
+                    future.cancel()
+                    return False
+
+    def produce() -> None:
+        items = iter(iterable)
+        try:
+            for item in items:
+                if stop.is_set() or not put((item, None)):
+                    return
+            put((done, None))
+        except BaseException as e:
+            put((done, e))
+        finally:
+            if isinstance(items, t.Generator):
+                items.close()
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = await ready.get()
+            if item is done:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+        await asyncio.to_thread(thread.join)
+
+
+def will_need(path: str) -> None:
+    """Ask the kernel to start reading `path` into the page cache, if supported."""
+    if not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+    finally:
+        os.close(fd)
+
+
+def to_record_batch(
+    records: list, schema: t.Optional[pa.Schema] = None
+) -> pa.RecordBatch:
+    """
+    Convert a list of records to a `pyarrow.RecordBatch`, inferring the schema from
+    all records (not just the first) when none is given.
+    """
+    if schema is not None:
+        return pa.RecordBatch.from_pylist(records, schema=schema)
+    if not records:
+        return pa.RecordBatch.from_pylist([])
+    return pa.RecordBatch.from_struct_array(pa.array(records))
+
+
+def batched(
+    records: t.Iterable[T],
+    size: int,
+    arrow: bool = False,
+    schema: t.Optional[pa.Schema] = None,
+) -> t.Generator[t.Any, None, None]:
+    """Group a record iterator into lists (or `RecordBatch`es) of up to `size`."""
+    records = iter(records)
+    while batch := list(islice(records, size)):
+        yield to_record_batch(batch, schema) if arrow else batch
+
+
+def records(
+    stream_path: str = "../data/raw/en-stream-2023-07-01",
+    start_date: str = "2022-11-17",
+    end_date: str = "2023-07-01",
+    log: bool = True,
+    workers: int = 0,
+    chunk_bytes: int = 64 * 1024 * 1024,
+    backend: t.Literal["jsonl", "parquet"] = "jsonl",
+    types: t.Optional[t.Collection[str]] = None,
+    columns: t.Optional[list[str]] = None,
+    lazy: bool = False,
+    start: t.Optional[str] = None,
+    end: t.Optional[str] = None,
+    batch_size: t.Optional[int] = None,
+    arrow: bool = False,
+    schema: t.Optional[pa.Schema] = None,
+    prefetch: int = 0,
+    metrics: t.Optional["Metrics"] = None,
+    compact: t.Optional["CompactEncoder"] = None,
+    dedupe: t.Union[bool, "HashSet"] = False,
+    sample_users: t.Optional[float] = None,
+    seed: int = 0,
+    ordered: bool = True,
+    chronological: bool = False,
+) -> t.Generator["Record", None, None]:
+    """
+    Generator that yields records from the stream for the given date range.
+
+    End date is inclusive. Days stored as `{day}.jsonl.zst` (see `zst.compress`) are
+    read transparently. If `stream_path` is a single JSONL file, that file is read
+    instead of the days, keeping the records created (`createdAt`) between `start_date`
+    and `end_date` as if `start`/`end` were given. With `workers > 0`, each file is
+    split into newline-aligned chunks of `chunk_bytes` which are decoded in a process
+    pool; records are still yielded in day (and line) order, unless `ordered=False`.
+
+    `types` keeps only records with those `$type`s; days with a `LineIndex` seek
+    straight to the matching lines instead of decoding every record.
+
+    `columns` (e.g. `["did", "subject.uri"]`) keeps only those fields (and
+    `$type`). With `backend="parquet"`, `stream_path` is a mirror written by
+    `parquet.convert`, and only the files for `types` and the given `columns` are
+    read. With `workers > 0`, records are reduced to `columns` (and filtered by
+    `types`, `start` and `end`) in the workers, so less is sent back: unpickling
+    whole records in the parent costs about 2/3 of decoding them, which caps the
+    speedup at ~1.5x. `arrow=True` batches are built in the workers and cost the
+    parent almost nothing.
+
+    With `lazy=True` (jsonl only), records are `LazyRecord`s, which keep the raw
+    line and skip decoding long records whose `$type` is all that's read. It has
+    no effect on `arrow=True` batches, which are built from decoded records.
+
+    `start`/`end` narrow the range to full ISO timestamps (`end` exclusive) and
+    override the dates. Records can arrive the day after they were created, so
+    the day after `end` is scanned too. With `chronological=True` (a stream
+    sorted by `chron.convert`), only the days of `start`..`end` are read and
+    each is entered by binary search on `createdAt` (see `jsonl.iter_between`),
+    so an hour costs about an hour's worth of I/O. `workers` doesn't apply to
+    those binary searches; otherwise the window is filtered in the workers.
+
+    With `batch_size`, lists of up to that many records are yielded instead (or
+    `pyarrow.RecordBatch`es with `arrow=True`, see `jsonl.iter_batches`). Parquet
+    batches are sliced from the files (see `parquet.iter_batches`); only the dict
+    API converts rows to Python objects.
+
+    With `prefetch > 0`, records are read and decoded in a background thread up to
+    `prefetch` batches (of `batch_size`, default 4096) ahead of the caller, and the
+    next day's file is pulled into the page cache while the current one is read.
+
+    With `metrics`, records, bytes and `$type`s are counted per batch (replacing the
+    per-day `log` output) and the metrics are closed when the stream ends.
+
+    With a `compact` encoder, records are `CompactRecord`s (or `COMPACT_DTYPE`
+    arrays with `batch_size`) holding integer ids instead of strings.
+
+    With `dedupe=True` (or a `HashSet` to share across calls), records whose `uri`
+    was already seen are dropped, and counted as "duplicates" in `metrics`.
+
+    `sample_users=0.01` keeps a deterministic 1% of users (see `UserSample`, keyed
+    by `seed`) and only the records between them.
+    """
+    # A single file isn't split by day: keep the records created in the range
+    if backend == "jsonl" and os.path.isfile(jsonl.resolve(stream_path)):
+        start = start or f"{start_date}T00:00:00Z"
+        if end is None:
+            end_day = _utc_day(timestamp_us(f"{end_date}T00:00:00Z") + chron.DAY_US)
+            end = f"{end_day}T00:00:00Z"
+
+    if (
+        batch_size
+        or prefetch
+        or metrics is not None
+        or compact is not None
+        or dedupe is not False
+        or sample_users is not None
+    ):
+        options = dict(
+            stream_path=stream_path,
+            start_date=start_date,
+            end_date=end_date,
+            log=log and metrics is None,
+            workers=workers,
+            chunk_bytes=chunk_bytes,
+            backend=backend,
+            types=types,
+            columns=columns,
+            lazy=lazy,
+            start=start,
+            end=end,
+            ordered=ordered,
+            chronological=chronological,
+        )
+        sample = UserSample(sample_users, seed) if sample_users is not None else None
+        arrow = arrow and bool(batch_size) and compact is None
+        options["lazy"] = lazy and not arrow
+        batches = _record_batches(
+            batch_size or 4096,
+            arrow,
+            schema,
+            prefetch > 0,
+            metrics,
+            sample,
+            **options,
+        )
+        if sample is not None:
+            batches = _sample_batches(batches, sample)
+        if dedupe is not False:
+            seen = HashSet() if dedupe is True else dedupe
+            batches = _dedupe_batches(batches, seen, metrics)
+        if compact is not None:
+            batches = map(compact.encode_batch, batches)
+        if prefetch:
+            batches = prefetched(batches, prefetch)
+        try:
+            if batch_size:
+                yield from batches
+            elif compact is not None:
+                for batch in batches:
+                    yield from CompactRecord.from_array(batch)
+            else:
+                for batch in batches:
+                    yield from batch
+        finally:
+            if metrics is not None:
+                metrics.close()
+        return
+
+    if backend == "parquet":
+        days, window = _parquet_days(start_date, end_date, start, end)
+        for ts in tq(days, active=log):
+            yield from parquet.iter(stream_path, ts, types, columns, window)
+        return
+
+    files = _jsonl_files(stream_path, start_date, end_date, start, end, chronological)
+    paths = tq(files, active=log)
+
+    if workers > 0 and not (chronological and (start or end)):
+        tasks = _range_tasks(paths, chunk_bytes, types, lazy, start, end, columns)
+        for chunk in pmap(_read_range, tasks, workers, ordered=ordered):
+            yield from chunk
+        return
+
+    stream: t.Iterable[Record]
+    if start or end:
+        stream = (
+            record
+            for path in paths
+            for record in jsonl[Record].iter_between(
+                path, start, end, types=types, lazy=lazy, chronological=chronological
+            )
+        )
+    else:
+        stream = (
+            record
+            for path in paths
+            for record in jsonl[Record].iter(path, types=types, lazy=lazy)
+        )
+    if columns is not None:
+        stream = (jsonl._project(record, columns) for record in stream)  # type: ignore
+    yield from stream
+
+
+def _parquet_days(
+    start_date: str, end_date: str, start: t.Optional[str], end: t.Optional[str]
+) -> tuple[list[str], tuple[t.Optional[int], t.Optional[int]]]:
+    """Days of a parquet mirror to read, and the `createdAt` window within them."""
+    if start:
+        start_date = _utc_day(timestamp_us(start))
+    if end:
+        end_date = _utc_day(timestamp_us(end) - 1 + chron.DAY_US)
+    window = (
+        timestamp_us(start) if start else None,
+        timestamp_us(end) if end else None,
+    )
+    return generate_timestamps(start_date, end_date), window
+
+
+def _jsonl_files(
+    stream_path: str,
+    start_date: str,
+    end_date: str,
+    start: t.Optional[str],
+    end: t.Optional[str],
+    chronological: bool,
+) -> list[str]:
+    """The files `records` reads, with the dates narrowed to `start`/`end`."""
+    if start:
+        start_date = _utc_day(timestamp_us(start))
+    if not end:
+        return stream_files(stream_path, start_date, end_date)
+
+    # Unsorted days can hold records created late the day before
+    end_date = _utc_day(timestamp_us(end) - 1 + (0 if chronological else chron.DAY_US))
+    files = stream_files(stream_path, start_date, end_date)
+    if (
+        not chronological
+        and len(files) > 1
+        and not os.path.exists(jsonl.resolve(files[-1]))
+    ):
+        # The extra day may be past the end of the stream
+        files = files[:-1]
+    return files
+
+
+def _range_tasks(
+    paths: t.Iterable[str],
+    chunk_bytes: int,
+    types: t.Optional[t.Collection[str]],
+    lazy: bool,
+    start: t.Optional[str],
+    end: t.Optional[str],
+    columns: t.Optional[list[str]],
+) -> t.Generator[tuple, None, None]:
+    """`jsonl.read_range` arguments for each chunk of `paths`."""
+    window = (
+        timestamp_us(start) if start else None,
+        timestamp_us(end) if end else None,
+    )
+    for path in paths:
+        for lo, hi in jsonl.ranges(path, chunk_bytes):
+            yield path, lo, hi, types, lazy, window, columns
+
+
+def stream_files(stream_path: str, start_date: str, end_date: str) -> list[str]:
+    """
+    The JSONL files `records` reads: `stream_path` itself if it's a single file,
+    otherwise its `{day}.jsonl` for each day from `start_date` to `end_date`.
+    """
+    if os.path.isfile(jsonl.resolve(stream_path)):
+        return [stream_path]
+    days = generate_timestamps(start_date, end_date)
+    return [f"{stream_path}/{ts}.jsonl" for ts in days]
+
+
+def _record_batches(
+    size: int,
+    arrow: bool,
+    schema: t.Optional[pa.Schema],
+    hint: bool = False,
+    metrics: t.Optional["Metrics"] = None,
+    sample: t.Optional["UserSample"] = None,
+    **options: t.Any,
+) -> t.Generator[t.Any, None, None]:
+    """`records(batch_size=...)`: whole-day jsonl scans are batched as they're read."""
+    if options["backend"] == "jsonl" and not (
+        options["workers"] or options["start"] or options["end"] or options["columns"]
+    ):
+        paths = stream_files(
+            options["stream_path"], options["start_date"], options["end_date"]
+        )
+        if metrics is not None and metrics.total_bytes is None:
+            metrics.total_bytes = _total_bytes(paths)
+        for i, path in enumerate(tq(paths, active=options["log"])):
+            if hint and i + 1 < len(paths):
+                will_need(jsonl.resolve(paths[i + 1]))
+
+            # With a line index, only read the lines of sampled authors
+            dids: t.Any = None
+            if sample is not None:
+                index = LineIndex.load(jsonl.resolve(path))
+                dids = sample if index is None else sample.select(index.did_names)
+
+            yield from jsonl.iter_batches(
+                path,
+                size,
+                types=options["types"],
+                dids=dids,
+                lazy=options["lazy"],
+                arrow=arrow,
+                schema=schema,
+                metrics=metrics,
+            )
+        return
+
+    if (
+        arrow
+        and options["backend"] == "jsonl"
+        and options["workers"] > 0
+        and not (options["chronological"] and (options["start"] or options["end"]))
+    ):
+        # Workers build the RecordBatches, which are sent back as buffers
+        files = _jsonl_files(
+            options["stream_path"],
+            options["start_date"],
+            options["end_date"],
+            options["start"],
+            options["end"],
+            options["chronological"],
+        )
+        tasks = (
+            (task, size, schema)
+            for task in _range_tasks(
+                tq(files, active=options["log"]),
+                options["chunk_bytes"],
+                options["types"],
+                False,
+                options["start"],
+                options["end"],
+                options["columns"],
+            )
+        )
+        chunks = pmap(
+            _read_range_batches, tasks, options["workers"], ordered=options["ordered"]
+        )
+        for chunk in chunks:
+            for batch in chunk:
+                if metrics is not None:
+                    metrics.add_records(batch)
+                yield batch
+        return
+
+    if arrow and options["backend"] == "parquet":
+        # Sliced straight from the files, never built as dicts
+        days, window = _parquet_days(
+            options["start_date"], options["end_date"], options["start"], options["end"]
+        )
+        for day in tq(days, active=options["log"]):
+            for batch in parquet.iter_batches(
+                options["stream_path"],
+                day,
+                size,
+                options["types"],
+                options["columns"],
+                window,
+                schema,
+            ):
+                if metrics is not None:
+                    metrics.add_records(batch)
+                yield batch
+        return
+
+    for batch in batched(records(**options), size, arrow, schema):
+        if metrics is not None:
+            metrics.add_records(batch)
+        yield batch
+
+
+async def arecords(
+    *args: t.Any, depth: int = 2, **options: t.Any
+) -> t.AsyncGenerator[t.Any, None]:
+    """
+    `records` for `async for`; takes the same arguments.
+
+    Records are read and decoded in a background thread, up to `depth` batches
+    ahead (of `batch_size`, default 4096), and handed to the event loop a batch at a
+    time. With `workers > 0`, decoding itself also runs in a process pool.
+    """
+    batch_size = options.pop("batch_size", None)
+    if not batch_size:
+        options["arrow"] = False
+    batches = records(*args, batch_size=batch_size or 4096, **options)
+    compact = options.get("compact") is not None
+
+    async for batch in aiterate(batches, depth):
+        if batch_size:
+            yield batch
+        elif compact:
+            for record in CompactRecord.from_array(batch):
+                yield record
+        else:
+            for record in batch:
+                yield record
+
+
+def _sample_batches(
+    batches: t.Iterable[t.Any], sample: "UserSample"
+) -> t.Generator[t.Any, None, None]:
+    for batch in batches:
+        if isinstance(batch, pa.RecordBatch):
+            keep = [sample.keeps(row) for row in batch.to_pylist()]
+            if any(keep):
+                yield batch.filter(pa.array(keep))
+            continue
+
+        kept = [r for r in batch if sample.keeps(r)]
+        if kept:
+            yield kept
+
+
+def _dedupe_batches(
+    batches: t.Iterable[t.Any], seen: "HashSet", metrics: t.Optional["Metrics"]
+) -> t.Generator[t.Any, None, None]:
+    """Drop records whose `uri` is in `seen` (records without one are kept)."""
+    for batch in batches:
+        if isinstance(batch, pa.RecordBatch):
+            if "uri" not in batch.schema.names:
+                yield batch
+                continue
+            uris = batch.column("uri").to_pylist()
+        else:
+            uris = [r.get("uri") for r in batch]
+
+        has_uri = np.array([u is not None for u in uris], dtype=bool)
+        keep = ~has_uri
+        keep[has_uri] = seen.add([u for u in uris if u is not None])
+
+        duplicates = len(uris) - int(keep.sum())
+        if metrics is not None and (duplicates or "duplicates" not in metrics.counters):
+            metrics.add_counter("duplicates", duplicates)
+        if not duplicates:
+            yield batch
+        elif duplicates < len(uris):
+            if isinstance(batch, pa.RecordBatch):
+                yield batch.filter(pa.array(keep))
+            else:
+                yield [r for r, k in zip(batch, keep.tolist()) if k]
+
+
+def _total_bytes(paths: list[str]) -> t.Optional[int]:
+    """Combined size of uncompressed day files, or None if any is compressed."""
+    resolved = [jsonl.resolve(path) for path in paths]
+    if any(path.endswith(".zst") or not os.path.exists(path) for path in resolved):
+        return None
+    return sum(os.path.getsize(path) for path in resolved)
+
+
+class parquet:
+    """
+    Columnar mirror of a daily stream, stored as `{path}/{$type}/{day}.parquet`.
+
+    Each file keeps the record's line number within the day as `_idx`, so reading
+    several types back merges them into the original order. `embed` is stored as
+    a JSON string since its shape varies between posts.
+    """
+
+    JSON_COLUMNS = ("embed",)
+    # Rows per type converted to Arrow (and spilled) at a time
+    BATCH_ROWS = 65_536
+
+    @classmethod
+    def write_day(cls, jsonl_path: str, parquet_path: str, day: str) -> None:
+        """
+        Write one day's records to `{parquet_path}/{$type}/{day}.parquet`.
+
+        Rows are converted to Arrow `BATCH_ROWS` at a time per type and spilled
+        to `{parquet_path}/.spill-{day}/`, so memory is bounded by a batch rather
+        than the day. Each type is then written by one `ParquetWriter`, with the
+        schema unified across its batches (fields missing from a batch are null).
+        """
+        spill_dir = f"{parquet_path}/.spill-{day}"
+        shutil.rmtree(spill_dir, ignore_errors=True)
+        os.makedirs(spill_dir)
+
+        buffers: dict[str, list[dict]] = {}
+        spills: dict[str, list[tuple[str, pa.Schema]]] = {}
+
+        def spill(rtype: str) -> None:
+            table = pa.Table.from_struct_array(pa.array(buffers.pop(rtype)))
+            runs = spills.setdefault(rtype, [])
+            path = f"{spill_dir}/{list(spills).index(rtype)}-{len(runs)}.arrow"
+            csr._write_table(path, table)
+            runs.append((path, table.schema))
+
+        try:
+            for i, record in enumerate(jsonl[dict].iter(jsonl_path)):
+                row = {k: v for k, v in record.items() if k != "$type"}
+                row["_idx"] = i
+                for col in cls.JSON_COLUMNS:
+                    if col in row:
+                        row[col] = json.dumps(row[col])
+                rows = buffers.setdefault(record["$type"], [])
+                rows.append(row)
+                if len(rows) >= cls.BATCH_ROWS:
+                    spill(record["$type"])
+            for rtype in list(buffers):
+                spill(rtype)
+
+            for rtype, runs in spills.items():
+                schema = pa.unify_schemas(
+                    [schema for _, schema in runs], promote_options="permissive"
+                )
+                os.makedirs(f"{parquet_path}/{rtype}", exist_ok=True)
+                path = f"{parquet_path}/{rtype}/{day}.parquet"
+                with pq.ParquetWriter(f"{path}.tmp", schema) as writer:
+                    for run, _ in runs:
+                        with pa.memory_map(run) as source:
+                            table = pa.ipc.open_file(source).read_all()
+                            writer.write_table(cls._conform(table, schema))
+                os.replace(f"{path}.tmp", path)
+        finally:
+            shutil.rmtree(spill_dir, ignore_errors=True)
+
+    @classmethod
+    def convert(
+        cls,
+        stream_path: str,
+        parquet_path: str,
+        start_date: str = "2022-11-17",
+        end_date: str = "2023-07-01",
+        log: bool = True,
+    ) -> None:
+        """Write the daily JSONL files of `stream_path` to a parquet mirror."""
+        for ts in tq(generate_timestamps(start_date, end_date), active=log):
+            cls.write_day(f"{stream_path}/{ts}.jsonl", parquet_path, ts)
+
+    @classmethod
+    def iter(
+        cls,
+        parquet_path: str,
+        day: str,
+        types: t.Optional[t.Collection[str]] = None,
+        columns: t.Optional[list[str]] = None,
+        window: tuple[t.Optional[int], t.Optional[int]] = (None, None),
+    ) -> t.Generator["Record", None, None]:
+        """
+        Yield one day's records, reading only the files for `types` and the given
+        `columns`. Dotted columns (e.g. `subject.uri`) read a single nested field.
+        `window` keeps the records created (`createdAt`, epoch microseconds) in
+        `[start, end)`, and those without a readable time.
+        """
+        streams = [
+            cls._read(path, rtype, columns, window)
+            for rtype, path in cls._day_files(parquet_path, day, types)
+        ]
+        for row in heapq.merge(*streams, key=lambda row: row["_idx"]):
+            del row["_idx"]
+            yield row  # type: ignore
+
+    @classmethod
+    def iter_batches(
+        cls,
+        parquet_path: str,
+        day: str,
+        size: int,
+        types: t.Optional[t.Collection[str]] = None,
+        columns: t.Optional[list[str]] = None,
+        window: tuple[t.Optional[int], t.Optional[int]] = (None, None),
+        schema: t.Optional[pa.Schema] = None,
+    ) -> t.Generator[pa.RecordBatch, None, None]:
+        """
+        `iter`, as `RecordBatch`es of up to `size` rows sliced from the files
+        without building any Python objects. Dotted columns become structs
+        holding only those fields, and `embed` stays a JSON string. Types whose
+        columns clash (e.g. `subject` of likes and follows) need `columns` that
+        avoid them, or separate calls.
+        """
+        tables = []
+        for rtype, path in cls._day_files(parquet_path, day, types):
+            table = cls._nest(cls._read_table(path, columns, window))
+            type_column = pa.array([rtype] * len(table), pa.string())
+            tables.append(table.add_column(0, "$type", type_column))
+        if not tables:
+            return
+
+        if len(tables) == 1:
+            table = tables[0]
+        else:
+            try:
+                table = pa.concat_tables(tables, promote_options="default")
+            except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+                raise ValueError(f"Can't combine record types in one batch: {e}") from e
+            table = table.sort_by("_idx")
+        table = table.drop_columns(["_idx"])
+        if schema is not None:
+            table = cls._conform(table, schema)
+        yield from table.combine_chunks().to_batches(max_chunksize=size)
+
+    @staticmethod
+    def _day_files(
+        parquet_path: str, day: str, types: t.Optional[t.Collection[str]]
+    ) -> list[tuple[str, str]]:
+        if types is None:
+            types = sorted(t for t in os.listdir(parquet_path) if not t.startswith("."))
+        paths = [(rtype, f"{parquet_path}/{rtype}/{day}.parquet") for rtype in types]
+        return [(rtype, path) for rtype, path in paths if os.path.exists(path)]
+
+    @classmethod
+    def _read_table(
+        cls,
+        path: str,
+        columns: t.Optional[list[str]],
+        window: tuple[t.Optional[int], t.Optional[int]],
+    ) -> pa.Table:
+        """Read `columns` of a file (dotted ones flattened) within `window`."""
+        pf = pq.ParquetFile(path)
+        schema = pf.schema_arrow
+        filtered = window != (None, None) and "createdAt" in schema.names
+
+        if columns is None:
+            table = pf.read()
+            nested = []
+            extra = []
+        else:
+            top = [c for c in columns if "." not in c and c in schema.names]
+            # A whole column already holds its nested fields
+            nested = [
+                c
+                for c in columns
+                if "." in c and c.split(".")[0] not in top and cls._has_path(schema, c)
+            ]
+            extra = ["createdAt"] if filtered and "createdAt" not in top else []
+            table = pf.read(columns=["_idx", *top, *extra])
+
+        for col in nested:
+            values = pf.read(columns=[col]).column(0)
+            for part in col.split(".")[1:]:
+                values = pc.struct_field(values, part)
+            table = table.append_column(col, values)
+
+        if filtered:
+            table = table.filter(cls._in_window(table.column("createdAt"), *window))
+        return table.drop_columns(extra)
+
+    @staticmethod
+    def _in_window(
+        created: pa.ChunkedArray, start: t.Optional[int], end: t.Optional[int]
+    ) -> pa.ChunkedArray:
+        try:
+            ns = pc.cast(created, pa.timestamp("ns", "UTC")).cast(pa.int64())
+            times = pc.divide(ns, 1000)
+        except pa.ArrowInvalid:
+            # Timestamps Arrow can't parse (e.g. without a timezone)
+            times = pa.array(
+                [jsonl._record_time({"createdAt": v}) for v in created.to_pylist()],
+                pa.int64(),
+            )
+        keep = pa.scalar(True)
+        if start is not None:
+            keep = pc.and_(keep, pc.greater_equal(times, start))
+        if end is not None:
+            keep = pc.and_(keep, pc.less(times, end))
+        return pc.fill_null(keep, True)
+
+    @classmethod
+    def _nest(cls, table: pa.Table) -> pa.Table:
+        """Turn dotted columns (e.g. `subject.uri`) into struct columns."""
+        dotted = [name for name in table.column_names if "." in name]
+        tree: dict = {}
+        for name in dotted:
+            *parents, leaf = name.split(".")
+            node = tree
+            for parent in parents:
+                node = node.setdefault(parent, {})
+            node[leaf] = table.column(name).combine_chunks()
+
+        table = table.drop_columns(dotted)
+        for name, node in tree.items():
+            table = table.append_column(name, cls._struct(node))
+        return table
+
+    @classmethod
+    def _struct(cls, node: dict) -> pa.StructArray:
+        arrays = [cls._struct(v) if isinstance(v, dict) else v for v in node.values()]
+        # The struct is null where all of its fields are
+        missing = pc.is_null(arrays[0])
+        for array in arrays[1:]:
+            missing = pc.and_(missing, pc.is_null(array))
+        return pa.StructArray.from_arrays(arrays, list(node), mask=missing)
+
+    @staticmethod
+    def _conform(table: pa.Table, schema: pa.Schema) -> pa.Table:
+        """Select and cast `table` to `schema`, with nulls for missing columns."""
+        columns = [
+            table.column(field.name).cast(field.type)
+            if field.name in table.column_names
+            else pa.nulls(len(table), field.type)
+            for field in schema
+        ]
+        return pa.Table.from_arrays(columns, schema=schema)
+
+    @classmethod
+    def _read(
+        cls,
+        path: str,
+        rtype: str,
+        columns: t.Optional[list[str]],
+        window: tuple[t.Optional[int], t.Optional[int]],
+    ) -> t.Generator[dict, None, None]:
+        table = cls._read_table(path, columns, window)
+        for row in table.to_pylist():
+            record: dict = {"$type": rtype}
+            for key, value in row.items():
+                if value is None:
+                    continue
+                if key in cls.JSON_COLUMNS:
+                    value = json.loads(value)
+                if "." in key:
+                    *parents, leaf = key.split(".")
+                    node = record
+                    for parent in parents:
+                        node = node.setdefault(parent, {})
+                    node[leaf] = value
+                else:
+                    record[key] = value
+            yield record
+
+    @staticmethod
+    def _has_path(schema: pa.Schema, column: str) -> bool:
+        name, *rest = column.split(".")
+        if name not in schema.names:
+            return False
+
+        dtype = schema.field(name).type
+        for part in rest:
+            if not pa.types.is_struct(dtype) or dtype.get_field_index(part) == -1:
+                return False
+            dtype = dtype.field(part).type
+        return True
+
+
+class chron:
+    """
+    Chronologically sorted copy of a daily stream, made by an external merge sort.
+
+    Lines are read with `jsonl.iter` and sorted in runs that fit `memory_bytes`,
+    which are spilled to disk and k-way merged into `{day}.jsonl` files by sort
+    time. Lines are copied byte for byte, and ties keep their input order.
+
+    Day files that already exist (e.g. a boundary day written by a run over an
+    adjacent range) are merged with rather than overwritten; input lines that are
+    already in them (at the same sort time, up to `DEDUPE_MAX` distinct lines per
+    time) are skipped, so re-running a range is idempotent.
+    """
+
+    # Per-line overhead of a buffered (key, seq, line) entry, for the memory budget
+    ENTRY_BYTES = 120
+    # Most runs merged at once (each holds an open file and a read buffer)
+    MAX_MERGE = 256
+    _HEADER = struct.Struct("<qqI")  # key, seq, line length
+    # Distinct existing lines remembered per sort time, to skip them when re-merged
+    DEDUPE_MAX = 100_000
+    DAY_US = 86_400_000_000
+
+    @classmethod
+    def convert(
+        cls,
+        stream_path: str,
+        chron_path: str,
+        start_date: str = "2022-11-17",
+        end_date: str = "2023-07-01",
+        key: t.Literal["createdAt", "ts", "rkey"] = "createdAt",
+        memory_bytes: int = 1 << 30,
+        tmp_dir: t.Optional[str] = None,
+        log: bool = True,
+        max_skew: timedelta = timedelta(days=1),
+    ) -> None:
+        """
+        Sort the days `start_date`..`end_date` of `stream_path` into `chron_path`.
+
+        `key` is the sort time: `createdAt`, `ts` (see `epoch_us`), or the
+        rkey's TID time; the first two fall back to the rkey time when missing.
+        Records with no usable time, or one more than `max_skew` outside their
+        source day (bogus clocks), stay at the start of their source day. Output
+        days are those of the sorted times (UTC), so a record can move to a
+        neighbouring day's file. Runs are spilled to `tmp_dir` (default:
+        `{chron_path}/.runs`), which needs about as much space as the input.
+        """
+        tmp_dir = tmp_dir or f"{chron_path}/.runs"
+        os.makedirs(tmp_dir, exist_ok=True)
+        os.makedirs(chron_path, exist_ok=True)
 
-    def _get_time_steps(self) -> list[str]:
-        return [Path(f).stem for f in self.files]
+        skew_us = int(max_skew.total_seconds() * 1e6)
+        runs = []
+        try:
+            buffer: list[tuple[int, int, bytes]] = []
+            size = 0
+            seq = 0
+            for day in tq(generate_timestamps(start_date, end_date), active=log):
+                day_start = timestamp_us(f"{day}T00:00:00Z")
+                lo, hi = day_start - skew_us, day_start + cls.DAY_US + skew_us
+                for record in jsonl[LazyRecord].iter(
+                    f"{stream_path}/{day}.jsonl", lazy=True
+                ):
+                    sort_time = cls._sort_time(record, key)
+                    if sort_time is None or not lo <= sort_time < hi:
+                        sort_time = day_start
+                    line = (
+                        record.raw if record.raw.endswith(b"\n") else record.raw + b"\n"
+                    )
+                    buffer.append((sort_time, seq, line))
+                    seq += 1
+                    size += len(line) + cls.ENTRY_BYTES
+                    if size >= memory_bytes:
+                        runs.append(cls._spill(buffer, f"{tmp_dir}/{len(runs)}.run"))
+                        buffer, size = [], 0
+            if buffer:
+                runs.append(cls._spill(buffer, f"{tmp_dir}/{len(runs)}.run"))
+            del buffer
 
-    def get_beliefs(
-        self, topic: str, records: dict[str, LabeledRecord]
-    ) -> list[ExpressedBelief]:
-        return [
-            rec_opinion
-            for rec in records.values()
-            for rec_topic, rec_opinion in rec["labels"]
-            if rec_topic == topic
-        ]
+            # Pre-merge runs in groups until they can be merged in one pass
+            n = len(runs)
+            while len(runs) > cls.MAX_MERGE:
+                group, runs = runs[: cls.MAX_MERGE], runs[cls.MAX_MERGE :]
+                runs.append(cls._spill_merged(group, f"{tmp_dir}/{n}.run"))
+                n += 1
 
+            cls._merge(runs, chron_path, key)
+        finally:
+            for name in os.listdir(tmp_dir):
+                if name.endswith(".run"):
+                    os.remove(f"{tmp_dir}/{name}")
+            if not os.listdir(tmp_dir):
+                os.rmdir(tmp_dir)
 
-# === Iteration utils ===
+    @staticmethod
+    def _sort_time(record: LazyRecord, key: str) -> t.Optional[int]:
+        if key == "createdAt":
+            return record_time(record)
+        if key == "ts":
+            ts = record.get("ts")
+            return epoch_us(ts) if isinstance(ts, int) else record_time(record)
+        if key == "rkey":
+            uri = record.get("uri")
+            rkey = rkey_from_uri(uri) if isinstance(uri, str) else ""
+            rkey_time = int(tid.decode([rkey])[0][0])
+            return None if rkey_time < 0 else rkey_time
+        raise ValueError(f"Unknown sort key: {key}")
 
+    @classmethod
+    def _spill(cls, buffer: list[tuple[int, int, bytes]], path: str) -> str:
+        """Sort a buffer of `(key, seq, line)` and write it to a run file."""
+        buffer.sort()
+        with open(path, "wb", buffering=1 << 20) as f:
+            for sort_time, seq, line in buffer:
+                f.write(cls._HEADER.pack(sort_time, seq, len(line)))
+                f.write(line)
+        return path
 
-class jsonl[T]:
     @classmethod
-    def iter(cls, path: str) -> t.Generator[T, None, None]:
-        with open(path, "rb") as f:
-            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
-                for line in iter(mm.readline, b""):
-                    try:
-                        yield json.loads(line)
-                    except json.JSONDecodeError:
-                        print(f"JSONDecodeError: {line}")
-                        continue
+    def _spill_merged(cls, group: list[str], path: str) -> str:
+        with open(path, "wb", buffering=1 << 20) as f:
+            for sort_time, seq, line in heapq.merge(*map(cls._read_run, group)):
+                f.write(cls._HEADER.pack(sort_time, seq, len(line)))
+                f.write(line)
+        for run in group:
+            os.remove(run)
+        return path
 
+    @classmethod
+    def _read_run(cls, path: str) -> t.Generator[tuple[int, int, bytes], None, None]:
+        header_size = cls._HEADER.size
+        with open(path, "rb", buffering=1 << 20) as f:
+            while header := f.read(header_size):
+                sort_time, seq, length = cls._HEADER.unpack(header)
+                yield sort_time, seq, f.read(length)
 
-def records(
-    stream_path: str = "../data/raw/en-stream-2023-07-01",
-    start_date: str = "2022-11-17",
-    end_date: str = "2023-07-01",
-    log: bool = True,
-) -> t.Generator["Record", None, None]:
+    @classmethod
+    def _merge(cls, runs: list[str], chron_path: str, key: str) -> None:
+        """K-way merge the runs, writing each line to the file of its day."""
+        merged = heapq.merge(*map(cls._read_run, runs))
+        for day, lines in groupby(merged, key=lambda entry: _utc_day(entry[0])):
+            path = f"{chron_path}/{day}.jsonl"
+            if os.path.exists(path):
+                lines = heapq.merge(cls._read_day(path, day, key), lines)
+
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb", buffering=1 << 20) as out:
+                # Lines already in the file sort first among equal times (seq -1),
+                # so new lines are checked against those of their time only
+                prev_time, existing = None, {}
+                for sort_time, seq, line in lines:
+                    if sort_time != prev_time:
+                        prev_time, existing = sort_time, {}
+                    if seq == -1:
+                        if len(existing) < cls.DEDUPE_MAX:
+                            digest = blake2b(line, digest_size=16).digest()
+                            existing[digest] = existing.get(digest, 0) + 1
+                    elif existing:
+                        digest = blake2b(line, digest_size=16).digest()
+                        if existing.get(digest):
+                            existing[digest] -= 1
+                            continue
+                    out.write(line)
+            os.replace(tmp_path, path)
+
+    @classmethod
+    def _read_day(
+        cls, path: str, day: str, key: str
+    ) -> t.Generator[tuple[int, int, bytes], None, None]:
+        """An existing (sorted) day file, as merge entries."""
+        day_start = timestamp_us(f"{day}T00:00:00Z")
+        prev = day_start
+        for record in jsonl[LazyRecord].iter(path, lazy=True):
+            sort_time = cls._sort_time(record, key)
+            # Keep the file's order for lines whose time was clamped
+            if sort_time is None or _utc_day(sort_time) != day or sort_time < prev:
+                sort_time = prev
+            prev = sort_time
+            line = record.raw if record.raw.endswith(b"\n") else record.raw + b"\n"
+            yield sort_time, -1, line
+
+
+class MetricsSnapshot(t.TypedDict):
+    elapsed: float  # Seconds since the first update
+    count: int  # Items processed
+    bytes: int  # Input bytes processed
+    total: t.Optional[int]  # Expected items, if known
+    total_bytes: t.Optional[int]  # Expected bytes, if known
+    rate: float  # Items per second
+    byte_rate: float  # Bytes per second
+    eta: t.Optional[float]  # Seconds until done, if known
+    types: dict[str, int]  # Items per `$type`
+    counters: dict[str, int]  # Named event counts, e.g. "duplicates"
+
+
+class MetricsSink(t.Protocol):
+    def emit(self, snapshot: MetricsSnapshot) -> None: ...
+
+    def close(self, snapshot: MetricsSnapshot) -> None: ...
+
+
+class Metrics:
     """
-    Generator that yields records from the stream for the given date range.
+    Progress and throughput counters for a long-running loop.
 
-    End date is inclusive.
+    `add` only bumps counters and compares a monotonic clock (no syscall) against
+    the next deadline; snapshots are published to the `sinks` at most every
+    `interval` seconds and once more on `close`.
     """
 
-    def generate_timestamps(start_date: str, end_date: str) -> list[str]:
-        start_dt = datetime.strptime(start_date, "%Y-%m-%d")
-        end_dt = datetime.strptime(end_date, "%Y-%m-%d")
-        delta = end_dt - start_dt
+    def __init__(
+        self,
+        total: t.Optional[int] = None,
+        total_bytes: t.Optional[int] = None,
+        interval: float = 1.0,
+        sinks: t.Optional[list[MetricsSink]] = None,
+    ) -> None:
+        self.total = total
+        self.total_bytes = total_bytes
+        self.interval = interval
+        self.sinks = [TerminalSink()] if sinks is None else sinks
 
-        return [
-            (start_dt + timedelta(days=i)).strftime("%Y-%m-%d")
-            for i in range(delta.days + 1)
+        self.count = 0
+        self.bytes = 0
+        self.types: dict[str, int] = {}
+        self.counters: dict[str, int] = {}
+        self.start = time.monotonic()
+        self._next = self.start
+        self._closed = False
+
+    def add(
+        self,
+        n: int = 1,
+        nbytes: int = 0,
+        types: t.Optional[t.Mapping[str, int]] = None,
+    ) -> None:
+        self.count += n
+        self.bytes += nbytes
+        if types:
+            for name, k in types.items():
+                self.types[name] = self.types.get(name, 0) + k
+
+        if time.monotonic() >= self._next:
+            self.publish()
+
+    def add_counter(self, name: str, n: int = 1) -> None:
+        """Count `n` events of a kind (e.g. dropped duplicates), reported with rates."""
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_records(self, batch: t.Any, nbytes: int = 0) -> None:
+        """Count a batch (list or `RecordBatch`) of records, per `$type`."""
+        types: dict[str, int] = {}
+        if isinstance(batch, pa.RecordBatch):
+            if "$type" in batch.schema.names:
+                for row in pc.value_counts(batch.column("$type")).to_pylist():
+                    types[row["values"]] = row["counts"]
+        else:
+            for record in batch:
+                name = record.get("$type")
+                types[name] = types.get(name, 0) + 1
+        self.add(len(batch), nbytes, types)
+
+    def track(self, iterable: t.Iterable[T]) -> t.Generator[T, None, None]:
+        """Yield from `iterable`, counting each item; closes when done."""
+        try:
+            for item in iterable:
+                yield item
+                self.add()
+        finally:
+            self.close()
+
+    def snapshot(self) -> MetricsSnapshot:
+        elapsed = time.monotonic() - self.start
+        rate = self.count / elapsed if elapsed > 0 else 0.0
+        byte_rate = self.bytes / elapsed if elapsed > 0 else 0.0
+
+        eta = None
+        if self.total is not None and rate > 0:
+            eta = max(self.total - self.count, 0) / rate
+        elif self.total_bytes is not None and byte_rate > 0:
+            eta = max(self.total_bytes - self.bytes, 0) / byte_rate
+
+        return {
+            "elapsed": elapsed,
+            "count": self.count,
+            "bytes": self.bytes,
+            "total": self.total,
+            "total_bytes": self.total_bytes,
+            "rate": rate,
+            "byte_rate": byte_rate,
+            "eta": eta,
+            "types": dict(self.types),
+            "counters": dict(self.counters),
+        }
+
+    def publish(self) -> None:
+        snapshot = self.snapshot()
+        for sink in self.sinks:
+            sink.emit(snapshot)
+        self._next = time.monotonic() + self.interval
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        snapshot = self.snapshot()
+        for sink in self.sinks:
+            sink.close(snapshot)
+
+
+class TerminalSink:
+    """Rewrite a one-line progress summary in place on stdout."""
+
+    def __init__(self, stream: t.TextIO = sys.stdout) -> None:
+        self.stream = stream
+
+    def emit(self, snapshot: MetricsSnapshot) -> None:
+        total, count = snapshot["total"], snapshot["count"]
+        if total:
+            line = f"{count}/{total} ({count / total * 100:.2f}%)"
+        else:
+            line = f"Processed: {count}"
+        if snapshot["elapsed"] > 0:
+            line += f" - {snapshot['rate']:.0f}/s"
+        if snapshot["bytes"]:
+            line += f", {snapshot['byte_rate'] / 1e6:.1f} MB/s"
+        for name, n in snapshot["counters"].items():
+            line += f", {name}: {n}"
+            if count:
+                line += f" ({n / count * 100:.2f}%)"
+        if snapshot["eta"] is not None:
+            line += f" - {snapshot['eta'] / 60:.1f}m until done"
+
+        self.stream.write(f"\r{line}")
+        self.stream.flush()
+
+    def close(self, snapshot: MetricsSnapshot) -> None:
+        self.emit(snapshot)
+        self.stream.write("\n")
+        self.stream.flush()
+
+
+class JsonLinesSink:
+    """Append each snapshot as a JSON line to `path`."""
+
+    def __init__(self, path: str) -> None:
+        self.file = open(path, "a")
+
+    def emit(self, snapshot: MetricsSnapshot) -> None:
+        self.file.write(json.dumps({"time": time.time(), **snapshot}) + "\n")
+        self.file.flush()
+
+    def close(self, snapshot: MetricsSnapshot) -> None:
+        self.emit(snapshot)
+        self.file.close()
+
+
+class PrometheusSink:
+    """
+    Write snapshots to `path` in the Prometheus text format, for node_exporter's
+    textfile collector. The file is replaced atomically on each update.
+    """
+
+    def __init__(self, path: str, prefix: str = "bsky_net") -> None:
+        self.path = path
+        self.prefix = prefix
+
+    def emit(self, snapshot: MetricsSnapshot) -> None:
+        p = self.prefix
+        metrics = [
+            ("records_total", "counter", snapshot["count"]),
+            ("bytes_total", "counter", snapshot["bytes"]),
+            ("records_per_second", "gauge", snapshot["rate"]),
+            ("bytes_per_second", "gauge", snapshot["byte_rate"]),
+            ("elapsed_seconds", "gauge", snapshot["elapsed"]),
         ]
+        if snapshot["eta"] is not None:
+            metrics.append(("eta_seconds", "gauge", snapshot["eta"]))
+        for name, n in sorted(snapshot["counters"].items()):
+            metrics.append((f"{name}_total", "counter", n))
 
-    for ts in tq(generate_timestamps(start_date, end_date), active=log):
-        for record in jsonl[Record].iter(f"{stream_path}/{ts}.jsonl"):
-            yield record
+        lines = []
+        for name, kind, value in metrics:
+            lines += [f"# TYPE {p}_{name} {kind}", f"{p}_{name} {value}"]
+        if snapshot["types"]:
+            lines.append(f"# TYPE {p}_records_by_type_total counter")
+            for name, count in sorted(snapshot["types"].items(), key=str):
+                lines.append(f'{p}_records_by_type_total{{type="{name}"}} {count}')
 
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp, self.path)
 
-def tq(iterable: t.Iterable[T], active: bool = True) -> t.Generator[T, None, None]:
-    total = len(iterable) if isinstance(iterable, t.Sized) else None
+    def close(self, snapshot: MetricsSnapshot) -> None:
+        self.emit(snapshot)
 
-    start_time = time.time()
-    estimated_time_remaining = 0
 
-    for i, item in enumerate(iterable):
-        if active:
-            if total:
-                elapsed_time = time.time() - start_time
-                items_per_second = (i + 1) / elapsed_time if elapsed_time > 0 else 0
-                estimated_time_remaining = (
-                    (total - i - 1) / items_per_second if items_per_second > 0 else 0
-                )
-                sys.stdout.write(
-                    f"\r{i + 1}/{total} ({((i + 1) / total) * 100:.2f}%) - {estimated_time_remaining / 60:.1f}m until done"
-                )
-                sys.stdout.flush()
-            else:
-                sys.stdout.write(f"\rProcessed: {i + 1}")
-                sys.stdout.flush()
+def tq(
+    iterable: t.Iterable[T], active: bool = True, interval: float = 0.5
+) -> t.Generator[T, None, None]:
+    """Print progress through `iterable` to stdout, at most every `interval` seconds."""
+    if not active:
+        yield from iterable
+        return
 
-        yield item
+    total = len(iterable) if isinstance(iterable, t.Sized) else None
+    yield from Metrics(total=total, interval=interval).track(iterable)
 
 
 # === Data types ===
@@ -233,6 +3309,126 @@ Post = ExistingPost | DeletedPost
 Record = Post | Follow | Repost | Like | Block | Profile
 
 
+class RecordType(IntEnum):
+    other = 0
+    post = 1
+    like = 2
+    repost = 3
+    follow = 4
+    block = 5
+    profile = 6
+
+    @classmethod
+    def of(cls, nsid: t.Optional[str]) -> "RecordType":
+        return _RECORD_TYPES.get(nsid, cls.other)  # type: ignore[arg-type]
+
+
+_RECORD_TYPES = {
+    "app.bsky.feed.post": RecordType.post,
+    "app.bsky.feed.like": RecordType.like,
+    "app.bsky.feed.repost": RecordType.repost,
+    "app.bsky.graph.follow": RecordType.follow,
+    "app.bsky.graph.block": RecordType.block,
+    "app.bsky.actor.profile": RecordType.profile,
+}
+
+# One row per record; ids are from the DID and post URI `StringDict`s, -1 if unknown
+COMPACT_DTYPE = np.dtype(
+    [
+        ("type", np.uint8),  # RecordType
+        ("did", np.int32),  # Author
+        ("created", np.int64),  # createdAt, epoch microseconds (-1 if missing)
+        ("uri", np.int64),  # The post's own URI (posts only)
+        (
+            "subject",
+            np.int64,
+        ),  # Followed/blocked DID, liked/reposted post, or reply parent
+    ]
+)
+
+
+class CompactRecord:
+    """
+    A record reduced to integers: ~150 bytes instead of ~1 KB for the dict, or 29
+    bytes as a `COMPACT_DTYPE` row. `CompactEncoder` makes them.
+    """
+
+    __slots__ = ("type", "did", "created", "uri", "subject")
+
+    def __init__(
+        self, type: int, did: int, created: int, uri: int = -1, subject: int = -1
+    ) -> None:
+        self.type = RecordType(type)
+        self.did = did
+        self.created = created
+        self.uri = uri
+        self.subject = subject
+
+    def __repr__(self) -> str:
+        return (
+            f"CompactRecord({self.type.name}, did={self.did}, created={self.created}, "
+            f"uri={self.uri}, subject={self.subject})"
+        )
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, CompactRecord):
+            return NotImplemented
+        return all(getattr(self, k) == getattr(other, k) for k in self.__slots__)
+
+    @classmethod
+    def from_array(cls, rows: np.ndarray) -> list["CompactRecord"]:
+        return [cls(*row) for row in rows.tolist()]
+
+
+class CompactEncoder:
+    """Turn records into `COMPACT_DTYPE` rows, interning DIDs and post URIs."""
+
+    def __init__(self, dids: "StringDict", uris: "StringDict") -> None:
+        self.dids = dids
+        self.uris = uris
+
+    def encode(self, record: t.Mapping[str, t.Any]) -> CompactRecord:
+        return CompactRecord(*self.encode_batch([record]).tolist()[0])
+
+    def encode_batch(self, records: t.Sequence[t.Mapping[str, t.Any]]) -> np.ndarray:
+        out = np.full(len(records), -1, dtype=COMPACT_DTYPE)
+        types = [RecordType.of(r.get("$type")) for r in records]
+        out["type"] = types
+        out["did"] = self.dids.encode([r.get("did", "") for r in records])
+        times = [jsonl._record_time(r) for r in records]
+        out["created"] = [-1 if ts is None else ts for ts in times]
+
+        # Look up each dictionary once for the whole batch
+        posts, subject_dids, subject_posts = [], [], []
+        for i, (record, rtype) in enumerate(zip(records, types)):
+            if rtype == RecordType.post:
+                posts.append((i, record.get("uri", "")))
+                reply = record.get("reply")
+                if reply:
+                    subject_posts.append((i, _nested_uri(reply, "parent")))
+            elif rtype in (RecordType.follow, RecordType.block):
+                subject_dids.append((i, record.get("subject", "")))
+            elif rtype in (RecordType.like, RecordType.repost):
+                subject_posts.append((i, _nested_uri(record, "subject")))
+
+        for column, pairs, strings in (
+            ("uri", posts, self.uris),
+            ("subject", subject_dids, self.dids),
+            ("subject", subject_posts, self.uris),
+        ):
+            if pairs:
+                rows, keys = zip(*pairs)
+                out[column][list(rows)] = strings.encode(keys)
+        return out
+
+
+def _nested_uri(record: t.Any, key: str) -> str:
+    """`record[key]["uri"]`, or "" (encoded as -1) if the record is malformed."""
+    value = record.get(key) if isinstance(record, t.Mapping) else None
+    uri = value.get("uri", "") if isinstance(value, t.Mapping) else ""
+    return uri if isinstance(uri, str) else ""
+
+
 # === Data utils ===
 
 
@@ -250,7 +3446,175 @@ def truncate_timestamp(timestamp: str, format: TimeFormat) -> str:
 
     e.g. "2023-01-01" for "daily, "2023-01" for "monthly"
     """
-    return datetime.fromisoformat(timestamp.replace("Z", "+00:00")).strftime(format)
+    return bucket_label(time_bucket(timestamp, format), format)
+
+
+# Characters of an ISO timestamp that decide its bucket, e.g. "2023-01-01T12" (hourly)
+_PREFIX_LENGTHS = {
+    TimeFormat.minute: 16,
+    TimeFormat.hourly: 13,
+    TimeFormat.daily: 10,
+    TimeFormat.weekly: 10,
+    TimeFormat.monthly: 7,
+}
+_bucket_cache: dict[TimeFormat, dict[str, int]] = {f: {} for f in TimeFormat}
+_EPOCH_NAIVE = datetime(1970, 1, 1)
+_EPOCH_ORDINAL = _EPOCH_NAIVE.toordinal()
+
+
+def time_bucket(timestamp: t.Union[str, int], format: TimeFormat) -> int:
+    """
+    Integer id of the `format` bucket holding `timestamp`, a `createdAt` string or
+    an epoch timestamp in seconds, milliseconds or microseconds (see `epoch_us`).
+    Ids increase with time: minutes/hours/days since the epoch, `year * 54 + week`
+    (`%W`) or `year * 12 + month - 1`. See `bucket_label`.
+
+    Like `truncate_timestamp`, strings are bucketed in their own UTC offset. Ids
+    are cached by timestamp prefix, so most calls cost a dict lookup.
+    """
+    if not isinstance(timestamp, str):
+        dt = _EPOCH_NAIVE + timedelta(microseconds=epoch_us(int(timestamp)))
+        return _bucket_of(dt, format)
+
+    cache = _bucket_cache[format]
+    prefix = timestamp[: _PREFIX_LENGTHS[format]]
+    bucket = cache.get(prefix)
+    if bucket is not None:
+        return bucket
+
+    dt = datetime.fromisoformat(timestamp.replace("Z", "+00:00")).replace(tzinfo=None)
+    bucket = _bucket_of(dt, format)
+    # Only cache prefixes in the standard layout, which pin down the bucket
+    if dt.isoformat()[: len(prefix)] == prefix:
+        cache[prefix] = bucket
+    return bucket
+
+
+def _bucket_of(dt: datetime, format: TimeFormat) -> int:
+    days = dt.toordinal() - _EPOCH_ORDINAL
+    if format == TimeFormat.minute:
+        return (days * 24 + dt.hour) * 60 + dt.minute
+    if format == TimeFormat.hourly:
+        return days * 24 + dt.hour
+    if format == TimeFormat.daily:
+        return days
+    if format == TimeFormat.weekly:
+        yday = dt.timetuple().tm_yday - 1
+        return dt.year * 54 + (yday + 7 - dt.weekday()) // 7
+    return dt.year * 12 + dt.month - 1
+
+
+def time_buckets(
+    timestamps: t.Union[t.Iterable[t.Union[str, int]], np.ndarray, pa.Array],
+    format: TimeFormat,
+) -> np.ndarray:
+    """
+    `time_bucket` for many timestamps at once, as an int64 array. Integer
+    timestamps (in any unit `epoch_us` tells apart) are bucketed with NumPy
+    arithmetic.
+    """
+    if isinstance(timestamps, (pa.Array, pa.ChunkedArray)):
+        if pa.types.is_integer(timestamps.type):
+            timestamps = timestamps.to_numpy()
+        else:
+            timestamps = timestamps.to_pylist()
+    if not isinstance(timestamps, np.ndarray) or timestamps.dtype.kind not in "iu":
+        return np.fromiter(
+            (time_bucket(ts, format) for ts in timestamps), dtype=np.int64
+        )
+
+    us = timestamps.astype(np.int64)
+    magnitude = np.abs(us)
+    us = np.where(
+        magnitude < 10**11,
+        us * 1_000_000,
+        np.where(magnitude < 10**14, us * 1_000, us),
+    )
+    if format == TimeFormat.minute:
+        return us // 60_000_000
+    if format == TimeFormat.hourly:
+        return us // 3_600_000_000
+
+    days = us // 86_400_000_000
+    if format == TimeFormat.daily:
+        return days
+
+    dates = days.astype("datetime64[D]")
+    if format == TimeFormat.monthly:
+        return dates.astype("datetime64[M]").astype(np.int64) + 1970 * 12
+
+    years = dates.astype("datetime64[Y]")
+    yday = (dates - years.astype("datetime64[D]")).astype(np.int64)
+    wday = (days + 3) % 7  # 1970-01-01 was a Thursday; Monday = 0
+    return (years.astype(np.int64) + 1970) * 54 + (yday + 7 - wday) // 7
+
+
+def bucket_start(bucket: int, format: TimeFormat) -> datetime:
+    """First moment of a `time_bucket` (naive, in the timestamps' own offset)."""
+    if format == TimeFormat.minute:
+        return _EPOCH_NAIVE + timedelta(minutes=bucket)
+    if format == TimeFormat.hourly:
+        return _EPOCH_NAIVE + timedelta(hours=bucket)
+    if format == TimeFormat.daily:
+        return _EPOCH_NAIVE + timedelta(days=bucket)
+    if format == TimeFormat.monthly:
+        year, month = divmod(bucket, 12)
+        return datetime(year, month + 1, 1)
+
+    year, week = divmod(bucket, 54)
+    jan1 = datetime(year, 1, 1)
+    if week == 0:
+        return jan1
+    first_monday = jan1 + timedelta(days=(7 - jan1.weekday()) % 7)
+    return first_monday + timedelta(weeks=week - 1)
+
+
+@lru_cache(maxsize=1 << 16)
+def bucket_label(
+    bucket: int, format: TimeFormat, label_format: t.Optional[str] = None
+) -> str:
+    """
+    The `truncate_timestamp` label of a `time_bucket`, e.g. for file names, or the
+    bucket's start formatted with `label_format`.
+    """
+    return bucket_start(bucket, format).strftime(label_format or format.value)
+
+
+def timestamp_us(timestamp: str) -> int:
+    """
+    Microseconds since the epoch for an ISO timestamp (e.g. a `createdAt`).
+
+    Timestamps without a timezone are taken as UTC.
+    """
+    dt = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return (dt - _EPOCH) // timedelta(microseconds=1)
+
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def epoch_us(ts: int) -> int:
+    """
+    Microseconds since the epoch for an integer timestamp (e.g. a record's `ts`) in
+    seconds, milliseconds or microseconds, told apart by magnitude.
+    """
+    if abs(ts) < 10**11:
+        return ts * 1_000_000
+    if abs(ts) < 10**14:
+        return ts * 1_000
+    return ts
+
+
+def _file_stat(path: str) -> list[int]:
+    """`[size, mtime_ns]` of `path`, which change when it's rewritten."""
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _utc_day(us: int) -> str:
+    return datetime.fromtimestamp(us / 1_000_000, timezone.utc).strftime("%Y-%m-%d")
 
 
 def did_from_uri(uri: str) -> str:
@@ -258,13 +3622,69 @@ def did_from_uri(uri: str) -> str:
         raise ValueError("\nMisformatted URI (empty string)")
 
     try:
-        return uri.split("/")[2]
+        return uri.split("/", 3)[2]
     except Exception:
         raise ValueError(f"\nMisformatted URI: {uri}")
 
 
 def rkey_from_uri(uri: str) -> str:
-    return uri.split("/")[-1]
+    return uri.rpartition("/")[2]
+
+
+class UriParts(t.TypedDict):
+    did: pa.Array  # Null where the URI is misformatted
+    collection: pa.Array
+    rkey: pa.Array
+    valid: np.ndarray  # bool
+    did_ids: t.Optional[np.ndarray]  # From `dids`, -1 where invalid or unknown
+
+
+def parse_uris(
+    uris: t.Union[t.Sequence[t.Optional[str]], pa.Array, pa.ChunkedArray],
+    dids: t.Optional["StringDict"] = None,
+) -> UriParts:
+    """
+    Split record at-URIs (`at://{did}/{collection}/{rkey}`) into Arrow arrays in a
+    few vectorised passes. Misformatted or null URIs are flagged in `valid` (and
+    null in the string arrays) instead of raising. Given `dids`, DIDs are also
+    encoded.
+    """
+    if isinstance(uris, pa.ChunkedArray):
+        uris = uris.combine_chunks()
+    elif not isinstance(uris, pa.Array):
+        uris = pa.array(uris, type=pa.string())
+
+    parts = pc.split_pattern(uris, "/")
+    values = parts.flatten()
+    starts = parts.offsets.to_numpy()[:-1]
+
+    valid = pc.list_value_length(parts).fill_null(0).to_numpy() == 5
+    valid &= (
+        pc.starts_with(uris, "at://").fill_null(False).to_numpy(zero_copy_only=False)
+    )
+
+    fields = []
+    for k in (2, 3, 4):
+        field = pc.take(values, pa.array(np.where(valid, starts + k, 0), mask=~valid))
+        valid &= pc.utf8_length(field).fill_null(0).to_numpy() > 0
+        fields.append(field)
+    did, collection, rkey = (
+        pc.if_else(pa.array(valid), field, pa.scalar(None, pa.string()))
+        for field in fields
+    )
+
+    did_ids = None
+    if dids is not None:
+        did_ids = dids.encode(d or "" for d in did.to_pylist())
+        did_ids[~valid] = -1
+
+    return {
+        "did": did,
+        "collection": collection,
+        "rkey": rkey,
+        "valid": valid,
+        "did_ids": did_ids,
+    }
 
 
 class s32:
@@ -282,11 +3702,18 @@ class s32:
     @classmethod
     def decode(cls, s: str) -> int:
         i = 0
-        for c in s:
-            i = i * 32 + s32.S32_CHAR.index(c)
+        values = _S32_VALUES
+        try:
+            for c in s:
+                i = i * 32 + values[c]
+        except KeyError as e:
+            raise ValueError(f"Invalid base32-sortable character: {e.args[0]!r}")
         return i
 
 
+_S32_VALUES = {c: i for i, c in enumerate(s32.S32_CHAR)}
+
+
 def parse_rkey(rev: str) -> tuple[datetime, int]:
     """Extract the data from the rkey of a URI"""
 
@@ -297,6 +3724,461 @@ def parse_rkey(rev: str) -> tuple[datetime, int]:
     return timestamp, clock_id
 
 
+class tid:
+    """
+    Vectorised codec for TIDs, the 13-character base32-sortable rkeys of records:
+    53 bits of epoch microseconds followed by a 10-bit clock id.
+    """
+
+    LENGTH = 13
+
+    # Byte -> base32 digit, 255 for bytes that aren't digits
+    _TABLE = np.full(256, 255, dtype=np.uint8)
+    _TABLE[np.frombuffer(s32.S32_CHAR.encode(), dtype=np.uint8)] = np.arange(32)
+    _CHARS = np.frombuffer(s32.S32_CHAR.encode(), dtype=np.uint8)
+
+    @classmethod
+    def decode(
+        cls, rkeys: t.Union[t.Sequence[t.Optional[str]], pa.Array, pa.ChunkedArray]
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Decode rkeys to `(timestamps, clock_ids, valid)` arrays. Timestamps are
+        int64 epoch microseconds; rkeys that aren't TIDs (e.g. "self") are -1 in
+        both and False in `valid`.
+        """
+        if isinstance(rkeys, (pa.Array, pa.ChunkedArray)):
+            rkeys = rkeys.to_pylist()
+        # Anything else (wrong length, non-ASCII, not a string) can't be a TID
+        rkeys = [
+            r if isinstance(r, str) and len(r) == cls.LENGTH and r.isascii() else ""
+            for r in rkeys
+        ]
+
+        chars = np.array(rkeys, dtype=f"S{cls.LENGTH}")
+        digits = cls._TABLE[chars.view(np.uint8).reshape(len(rkeys), cls.LENGTH)]
+        valid = (digits != 255).all(axis=1)
+
+        digits = digits.astype(np.int64)
+        timestamps = np.zeros(len(rkeys), dtype=np.int64)
+        for k in range(cls.LENGTH - 2):
+            timestamps = timestamps * 32 + digits[:, k]
+        clock_ids = digits[:, -2] * 32 + digits[:, -1]
+
+        valid &= timestamps < 2**53
+        timestamps[~valid] = -1
+        clock_ids[~valid] = -1
+        return timestamps, clock_ids, valid
+
+    @classmethod
+    def encode(
+        cls,
+        timestamps: t.Union[t.Sequence[int], np.ndarray],
+        clock_ids: t.Optional[t.Union[t.Sequence[int], np.ndarray]] = None,
+    ) -> list[str]:
+        """TIDs for epoch-microsecond `timestamps` (and clock ids, default 0)."""
+        values = np.asarray(timestamps, dtype=np.int64) << 10
+        if clock_ids is not None:
+            values |= np.asarray(clock_ids, dtype=np.int64) & 0x3FF
+
+        digits = np.empty((len(values), cls.LENGTH), dtype=np.uint8)
+        for k in range(cls.LENGTH - 1, -1, -1):
+            digits[:, k] = cls._CHARS[values & 31]
+            values = values >> 5
+        return digits.view(f"S{cls.LENGTH}").ravel().astype(str).tolist()
+
+
+def record_time(
+    record: t.Mapping[str, t.Any], max_skew: t.Optional[timedelta] = None
+) -> t.Optional[int]:
+    """
+    Epoch microseconds of a record: its `createdAt`, falling back to the time in
+    its rkey (TID) when `createdAt` is missing or unreadable, or more than
+    `max_skew` away from the rkey time. None if neither is usable.
+    """
+    created = jsonl._record_time(record)
+    if created is not None and max_skew is None:
+        return created
+
+    uri = record.get("uri")
+    rkey = rkey_from_uri(uri) if isinstance(uri, str) else ""
+    rkey_time = tid.decode([rkey])[0][0]
+    if rkey_time < 0:
+        return created
+    if created is None or abs(created - rkey_time) > max_skew.total_seconds() * 1e6:
+        return int(rkey_time)
+    return created
+
+
+def record_times(
+    records: t.Sequence[t.Mapping[str, t.Any]],
+    max_skew: t.Optional[timedelta] = None,
+) -> np.ndarray:
+    """
+    `record_time` for a batch, as an int64 array (-1 where unknown), e.g. to sort
+    records with `np.argsort` or bucket them with `time_buckets`.
+    """
+    times = [jsonl._record_time(r) for r in records]
+    created = np.array([-1 if ts is None else ts for ts in times], dtype=np.int64)
+    uris = [r.get("uri") for r in records]
+    rkeys = [rkey_from_uri(u) if isinstance(u, str) else None for u in uris]
+    rkey_times, _, valid = tid.decode(rkeys)
+
+    use_rkey = valid & (created < 0)
+    if max_skew is not None:
+        skew = np.abs(created - rkey_times) > max_skew.total_seconds() * 1e6
+        use_rkey |= valid & skew
+    return np.where(use_rkey, rkey_times, created)
+
+
+# === Dictionaries ===
+
+
+class StringDict:
+    """
+    Persistent string <-> id dictionary (e.g. for DIDs or post URIs), memory-mapped
+    from a directory written by `StringDict.build`.
+
+    Ids are dense, `0..n-1` in insertion order, and fit `self.dtype` (int32 unless
+    there are 2^31 or more strings). Strings are found by binary search over their
+    sorted 64-bit hashes, so a lookup touches a handful of pages and nothing has to
+    be loaded up front; a string that isn't in the dictionary has a ~n/2^64 chance
+    of a false hit.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(f"{path}/meta.json") as f:
+            self.salt: int = json.load(f)["salt"]
+
+        self.offsets: np.ndarray = np.load(f"{path}/offsets.npy", mmap_mode="r")
+        self.hashes: np.ndarray = np.load(f"{path}/hashes.npy", mmap_mode="r")
+        self.ids: np.ndarray = np.load(f"{path}/ids.npy", mmap_mode="r")
+        self.dtype = np.int32 if len(self) < 2**31 else np.int64
+
+        self._file = open(f"{path}/strings.bin", "rb")
+        if os.fstat(self._file.fileno()).st_size:
+            self._data: t.Union[mmap.mmap, bytes] = mmap.mmap(
+                self._file.fileno(), 0, access=mmap.ACCESS_READ
+            )
+        else:
+            self._data = b""
+        self._strings: t.Optional[pa.LargeStringArray] = None
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __contains__(self, string: object) -> bool:
+        return isinstance(string, str) and self.get(string) != -1
+
+    def __getitem__(self, string: str) -> int:
+        i = self.get(string)
+        if i == -1:
+            raise KeyError(string)
+        return i
+
+    def get(self, string: str, default: int = -1) -> int:
+        i = int(self.encode([string])[0])
+        return default if i == -1 else i
+
+    def string(self, i: int) -> str:
+        return self._data[self.offsets[i] : self.offsets[i + 1]].decode()
+
+    def encode(self, strings: t.Iterable[str]) -> np.ndarray:
+        """Ids of `strings` (-1 for strings not in the dictionary)."""
+        hashes = self._hash_all(strings, self.salt)
+        pos = np.searchsorted(self.hashes, hashes)
+        found = pos < len(self.hashes)
+        found[found] = self.hashes[pos[found]] == hashes[found]
+
+        out = np.full(len(hashes), -1, dtype=self.dtype)
+        out[found] = self.ids[pos[found]]
+        return out
+
+    def decode(self, ids: t.Iterable[int]) -> list[str]:
+        """Strings for `ids`."""
+        return self.decode_arrow(ids).to_pylist()
+
+    def decode_arrow(self, ids: t.Iterable[int]) -> pa.Array:
+        """Strings for `ids` as a pyarrow array, gathered without Python objects."""
+        if self._strings is None:
+            self._strings = pa.LargeStringArray.from_buffers(
+                len(self),
+                pa.py_buffer(np.ascontiguousarray(self.offsets)),
+                pa.py_buffer(self._data),
+            )
+        return self._strings.take(pa.array(np.asarray(ids, dtype=np.int64)))
+
+    def close(self) -> None:
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
+
+    @staticmethod
+    def _hash(data: bytes, salt: int) -> int:
+        key = salt.to_bytes(8, "little")
+        return int.from_bytes(blake2b(data, digest_size=8, key=key).digest(), "little")
+
+    @classmethod
+    def _hash_all(cls, strings: t.Iterable[str], salt: int) -> np.ndarray:
+        return np.fromiter(
+            (cls._hash(s.encode(), salt) for s in strings), dtype=np.uint64
+        )
+
+    @classmethod
+    def build(
+        cls, path: str, strings: t.Iterable[str], chunk_size: int = 1 << 20
+    ) -> "StringDict":
+        """
+        Write a dictionary of `strings` (duplicates keep their first id) to the
+        directory `path`, replacing any existing one.
+
+        Strings are streamed to disk, so memory is a few dozen bytes per string
+        (offsets and hash tables) rather than the strings themselves.
+        """
+        os.makedirs(path, exist_ok=True)
+        data_path = f"{path}/strings.bin"
+        lengths: list[np.ndarray] = []
+
+        with open(data_path, "wb") as f:
+            for chunk in batched(strings, chunk_size):
+                # Drop duplicates within the chunk up front
+                encoded = [s.encode() for s in dict.fromkeys(chunk)]
+                f.write(b"".join(encoded))
+                lengths.append(np.fromiter(map(len, encoded), dtype=np.int64))
+
+        offsets = np.zeros(sum(map(len, lengths)) + 1, dtype=np.int64)
+        if lengths:
+            np.cumsum(np.concatenate(lengths), out=offsets[1:])
+
+        with open(data_path, "rb") as f:
+            data = (
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                if offsets[-1]
+                else b""
+            )
+        try:
+            hashes, keep, salt = cls._dedupe(data, offsets)
+            if not keep.all():
+                kept = np.flatnonzero(keep)
+                with open(f"{data_path}.tmp", "wb") as f:
+                    for i in kept.tolist():
+                        f.write(data[offsets[i] : offsets[i + 1]])
+                os.replace(f"{data_path}.tmp", data_path)
+
+                offsets = np.concatenate(
+                    [[0], np.cumsum(offsets[kept + 1] - offsets[kept])]
+                ).astype(np.int64)
+                hashes = hashes[kept]
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
+
+        order = np.argsort(hashes, kind="stable")
+        np.save(f"{path}/offsets.npy", offsets)
+        np.save(f"{path}/hashes.npy", hashes[order])
+        np.save(f"{path}/ids.npy", order.astype(np.int64))
+        with open(f"{path}/meta.json", "w") as f:
+            json.dump({"salt": salt, "count": len(offsets) - 1}, f)
+
+        return cls(path)
+
+    @classmethod
+    def _dedupe(
+        cls, data: t.Union[mmap.mmap, bytes], offsets: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray, int]:
+        """
+        Hash every string and mark repeats (from different chunks) to drop. Two
+        different strings with the same hash are retried with the next salt.
+        """
+        n = len(offsets) - 1
+        salt = 0
+        while True:
+            hashes = np.fromiter(
+                (cls._hash(data[a:b], salt) for a, b in zip(offsets[:-1], offsets[1:])),
+                dtype=np.uint64,
+                count=n,
+            )
+            order = np.argsort(hashes, kind="stable")
+            sorted_hashes = hashes[order]
+
+            # Each run of equal hashes is compared with its first (lowest) id
+            repeats = np.flatnonzero(sorted_hashes[1:] == sorted_hashes[:-1]) + 1
+            run_starts = np.zeros(n, dtype=np.int64)
+            if n:
+                new_run = np.ones(n, dtype=bool)
+                new_run[repeats] = False
+                run_starts = np.maximum.accumulate(np.where(new_run, np.arange(n), 0))
+
+            keep = np.ones(n, dtype=bool)
+            for j in repeats.tolist():
+                a, b = order[run_starts[j]], order[j]
+                if (
+                    data[offsets[a] : offsets[a + 1]]
+                    != data[offsets[b] : offsets[b + 1]]
+                ):
+                    break
+                keep[b] = False
+            else:
+                return hashes, keep, salt
+            salt += 1
+
+
+class UserSample:
+    """
+    A deterministic `fraction` of users, picked by a keyed hash of their DID: the
+    same `seed` always picks the same users, and a smaller fraction picks a subset
+    of a larger one.
+
+    `keeps` selects the records between sampled users (the induced subgraph): the
+    author and every user a record points at (followed/blocked user, author of
+    the liked/reposted post) must be sampled. Posts by sampled users are always
+    kept, even when they reply to or quote an unsampled user's post, so every
+    like or repost that's kept points at a post that's kept too.
+    """
+
+    def __init__(self, fraction: float, seed: int = 0) -> None:
+        if not 0 <= fraction <= 1:
+            raise ValueError(f"Sample fraction must be in [0, 1], got {fraction}")
+        self.fraction = fraction
+        self.seed = seed
+        self._threshold = int(fraction * 2**64)
+
+    def __contains__(self, did: object) -> bool:
+        return isinstance(did, str) and _did_hash(did, self.seed) < self._threshold
+
+    def select(self, dids: t.Iterable[str]) -> list[str]:
+        return [did for did in dids if did in self]
+
+    def keeps(self, record: t.Mapping[str, t.Any]) -> bool:
+        if record.get("did") not in self:
+            return False
+        try:
+            return all(did in self for did in self._targets(record))
+        except (KeyError, TypeError, ValueError):
+            return False
+
+    @staticmethod
+    def _targets(record: t.Mapping[str, t.Any]) -> list[str]:
+        """DIDs of the users a record points at (posts are kept by author alone)."""
+        rtype = record.get("$type")
+        if rtype in ("app.bsky.graph.follow", "app.bsky.graph.block"):
+            return [record["subject"]]
+        if rtype in ("app.bsky.feed.like", "app.bsky.feed.repost"):
+            return [did_from_uri(record["subject"]["uri"])]
+        return []
+
+
+@lru_cache(maxsize=1 << 20)
+def _did_hash(did: str, seed: int) -> int:
+    key = seed.to_bytes(8, "little", signed=True)
+    return int.from_bytes(
+        blake2b(did.encode(), digest_size=8, key=key).digest(), "little"
+    )
+
+
+class HashSet:
+    """
+    Set of 64-bit fingerprints in a NumPy open-addressing table (linear probing),
+    at 8 bytes per slot and a load of at most `MAX_LOAD` (~11-23 bytes per item).
+
+    `add` works on whole batches. String fingerprints come from `hash`, which is
+    salted per process, so a set is only meaningful within one run; with n items,
+    about n^2 / 2^65 distinct strings are expected to collide.
+    """
+
+    MAX_LOAD = 0.7
+
+    def __init__(self, capacity: int = 1 << 20) -> None:
+        self.table = np.zeros(self._size_for(capacity), dtype=np.uint64)
+        self.count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __contains__(self, string: object) -> bool:
+        key = self.fingerprints([string])[0]
+        mask = len(self.table) - 1
+        slot = int(self._slots(np.array([key]))[0])
+        while True:
+            current = self.table[slot]
+            if current == key:
+                return True
+            if current == 0:
+                return False
+            slot = (slot + 1) & mask
+
+    @classmethod
+    def _size_for(cls, capacity: int) -> int:
+        return 1 << max(int(capacity / cls.MAX_LOAD), 1).bit_length()
+
+    @staticmethod
+    def fingerprints(strings: t.Iterable[t.Any]) -> np.ndarray:
+        keys = np.fromiter((hash(s) for s in strings), dtype=np.int64).view(np.uint64)
+        keys[keys == 0] = 1  # 0 marks an empty slot
+        return keys
+
+    def add(self, strings: t.Iterable[t.Any]) -> np.ndarray:
+        """Add `strings`; True where a string wasn't seen before (first occurrence)."""
+        return self.add_fingerprints(self.fingerprints(strings))
+
+    def add_fingerprints(self, keys: np.ndarray) -> np.ndarray:
+        is_new = np.zeros(len(keys), dtype=bool)
+        if not len(keys):
+            return is_new
+
+        # Only the first occurrence within the batch can be new
+        _, first = np.unique(keys, return_index=True)
+        first.sort()
+        # Keys already in the set don't take slots, so only grow up front if the
+        # table could fill up; otherwise grow once the load is known
+        if self.count + len(first) > 0.9 * len(self.table):
+            self._grow(self.count + len(first))
+
+        is_new[first] = self._insert(keys[first])
+        if self.count > self.MAX_LOAD * len(self.table):
+            self._grow(self.count)
+        return is_new
+
+    def _slots(self, keys: np.ndarray) -> np.ndarray:
+        # Fibonacci hashing spreads clustered keys over the table
+        bits = len(self.table).bit_length() - 1
+        with np.errstate(over="ignore"):
+            mixed = keys * np.uint64(0x9E3779B97F4A7C15)
+        return (mixed >> np.uint64(64 - bits)).astype(np.int64)
+
+    def _insert(self, keys: np.ndarray) -> np.ndarray:
+        """Insert distinct `keys`, returning True for those that weren't present."""
+        inserted = np.zeros(len(keys), dtype=bool)
+        mask = len(self.table) - 1
+        pending = np.arange(len(keys))
+        slots = self._slots(keys)
+
+        while len(pending):
+            k = keys[pending]
+            current = self.table[slots]
+            found = current == k
+            empty = current == 0
+
+            # Claim empty slots; when keys race for a slot, one write wins
+            self.table[slots[empty]] = k[empty]
+            won = empty & (self.table[slots] == k)
+            inserted[pending[won]] = True
+
+            retry = ~found & ~won
+            pending = pending[retry]
+            slots = (slots[retry] + 1) & mask
+
+        self.count += int(inserted.sum())
+        return inserted
+
+    def _grow(self, capacity: int) -> None:
+        keys = self.table[self.table != 0]
+        size = max(self._size_for(capacity), 2 * len(self.table))
+        self.table = np.zeros(size, dtype=np.uint64)
+        self.count = 0
+        self._insert(keys)
+
+
 # === Prompts ===
 
 